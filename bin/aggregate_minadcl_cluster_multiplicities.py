@@ -4,53 +4,115 @@ import argparse
 import csv
 import collections
 
+import numpy
+
+
+def split_list(value):
+    return value.split(":") if value else []
+
+
+class Codes(object):
+    "Assigns consecutive integer codes to values, in order of first appearance"
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def code(self, value):
+        if value not in self.index:
+            self.index[value] = len(self.values)
+            self.values.append(value)
+        return self.index[value]
+
+
+def aggregate_clusters(seqmeta, cluster_mapping, include_members=False):
+    """Group the sequences of each min-adcl cluster onto its centroid row, summing multiplicities (in total and by
+    timepoint) and concatenating duplicates. With include_members, each member's own id goes into the cluster
+    duplicates too, ahead of its duplicates (for when the members are themselves being collapsed away, see
+    collapse_duplicates.py). This is done as a group-by over integer coded (sequence, centroid, timepoint) columns,
+    and centroid rows are yielded in seqmeta order."""
+    seq_index = {row["sequence"]: i for i, row in enumerate(seqmeta)}
+    n_seqs = len(seqmeta)
+    # integer coded (centroid, sequence) membership pairs, deduplicated
+    pairs = numpy.unique(
+        numpy.array(
+            [
+                seq_index[centroid] * n_seqs + seq_index[sequence]
+                for centroid, sequence in cluster_mapping
+            ],
+            dtype=numpy.int64,
+        )
+    )
+    centroids, members = pairs // n_seqs, pairs % n_seqs
 
-def filter_by_ids(results, ids):
-    filtered_results = [result for result in results if result["unique_id"] in ids]
-    return filtered_results
-
+    multiplicities = numpy.array([int(row["multiplicity"]) for row in seqmeta])
+    cluster_multiplicities = numpy.bincount(
+        centroids, weights=multiplicities[members], minlength=n_seqs
+    )
 
-def aggregate_clusters(merge_results, cluster_mapping):
-    merge_results = {row["sequence"]: row for row in merge_results}
-    for centroid_id, sequence_ids in cluster_mapping.items():
-        centroid_data = merge_results[centroid_id]
-        sequences = [merge_results[sequence_id] for sequence_id in sequence_ids]
-        cluster_duplicates = reduce(
-            set.union, (seq["duplicates"] for seq in sequences), set()
-        )
-        timepoint_multiplicities = collections.defaultdict(lambda: 0)
-        # Aggregate our timepoint multiplicities
-        for seq in sequences:
-            for timepoint, timepoint_multiplicity in zip(
-                seq["timepoints"], seq["timepoint_multiplicities"]
-            ):
-                timepoint_multiplicities[timepoint] += int(timepoint_multiplicity)
-        centroid_data.update(
+    # one entry per (sequence, timepoint), in sequence order
+    timepoint_codes = Codes()
+    tp_seqs, tp_codes, tp_multiplicities = [], [], []
+    for i, row in enumerate(seqmeta):
+        # note that a sequence with no timepoint still has a multiplicity, which is kept under the empty timepoint
+        for timepoint, multiplicity in zip(
+            row["timepoints"].split(":"), row["timepoint_multiplicities"].split(":")
+        ):
+            tp_seqs.append(i)
+            tp_codes.append(timepoint_codes.code(timepoint))
+            tp_multiplicities.append(int(multiplicity))
+    tp_counts = numpy.bincount(tp_seqs, minlength=n_seqs)
+    tp_starts = numpy.concatenate([[0], numpy.cumsum(tp_counts)[:-1]])
+    # join each membership pair with its member's timepoint entries
+    pair_tp_counts = tp_counts[members]
+    pair_tp_entries = numpy.repeat(
+        tp_starts[members]
+        - numpy.concatenate([[0], numpy.cumsum(pair_tp_counts)[:-1]]),
+        pair_tp_counts,
+    ) + numpy.arange(pair_tp_counts.sum())
+    n_timepoints = len(timepoint_codes.values)
+    cluster_tp_multiplicities = numpy.bincount(
+        numpy.repeat(centroids, pair_tp_counts) * n_timepoints
+        + numpy.array(tp_codes, dtype=numpy.int64)[pair_tp_entries],
+        weights=numpy.array(tp_multiplicities)[pair_tp_entries],
+        minlength=n_seqs * n_timepoints,
+    ).reshape(n_seqs, n_timepoints)
+    cluster_tp_present = numpy.zeros((n_seqs, n_timepoints), dtype=bool)
+    cluster_tp_present[
+        numpy.repeat(centroids, pair_tp_counts),
+        numpy.array(tp_codes, dtype=numpy.int64)[pair_tp_entries],
+    ] = True
+
+    member_lists = collections.defaultdict(list)
+    for centroid, member in zip(centroids, members):
+        member_lists[centroid].append(member)
+
+    def cluster_duplicates(centroid):
+        # duplicates of distinct sequences are disjoint, so they can be streamed out without building a set
+        for member in member_lists[centroid]:
+            member_id = seqmeta[member]["sequence"]
+            if include_members:
+                yield member_id
+            for duplicate in split_list(seqmeta[member]["duplicates"]):
+                # process_partis lists each sequence among its own duplicates
+                if not include_members or duplicate != member_id:
+                    yield duplicate
+
+    for centroid in sorted(member_lists):
+        row = seqmeta[centroid]
+        present = numpy.flatnonzero(cluster_tp_present[centroid])
+        row.update(
             {
-                "cluster_duplicates": cluster_duplicates,
-                "cluster_multiplicity": sum(
-                    int(seq["multiplicity"]) for seq in sequences
+                "cluster_duplicates": ":".join(cluster_duplicates(centroid)),
+                "cluster_multiplicity": int(cluster_multiplicities[centroid]),
+                "cluster_timepoints": ":".join(
+                    timepoint_codes.values[tp] for tp in present
+                ),
+                "cluster_timepoint_multiplicities": ":".join(
+                    str(int(cluster_tp_multiplicities[centroid, tp])) for tp in present
                 ),
-                "cluster_timepoints": timepoint_multiplicities.keys(),
-                "cluster_timepoint_multiplicities": timepoint_multiplicities.values(),
             }
         )
-        yield centroid_data
-
-
-def format_list(row, key):
-    if key in row:
-        row[key] = ":".join(map(str, row[key]))
-
-
-def format_results(results):
-    for row in results:
-        format_list(row, "timepoints")
-        format_list(row, "timepoint_multiplicities")
-        format_list(row, "duplicates")
-        format_list(row, "cluster_duplicates")
-        format_list(row, "cluster_timepoints")
-        format_list(row, "cluster_timepoint_multiplicities")
         yield row
 
 
@@ -63,32 +125,9 @@ def csv_reader(filename):
 
 
 def cluster_reader(filename):
-    data = csv_reader(filename)
-    result = collections.defaultdict(set)
-    for d in data:
-        result[d["centroid"]].add(d["sequence"])
-    return result
-
-
-def merge(d1, d2):
-    d1 = d1.copy()
-    d1.update(d2)
-    return d1
-
-
-def seqmeta_reader(filename):
-    data = csv_reader(filename)
-    return [
-        merge(
-            d,
-            {
-                "timepoints": d["timepoints"].split(":"),
-                "timepoint_multiplicities": d["timepoint_multiplicities"].split(":"),
-                "duplicates": d["duplicates"].split(":"),
-            },
-        )
-        for d in data
-    ]
+    "(centroid, sequence) pairs"
+    with open(filename) as fh:
+        return [(row["centroid"], row["sequence"]) for row in csv.DictReader(fh)]
 
 
 def pruned_ids_reader(filename):
@@ -102,7 +141,7 @@ def pruned_ids_reader(filename):
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--cluster-mapping", type=cluster_reader)
-    parser.add_argument("--partis-seqmeta", type=seqmeta_reader)
+    parser.add_argument("--partis-seqmeta", type=csv_reader)
     parser.add_argument("--pruned-ids", type=pruned_ids_reader)
     parser.add_argument("output", type=argparse.FileType("w"))
     args = parser.parse_args()
@@ -142,9 +181,10 @@ def main():
     results = args.partis_seqmeta
     if args.cluster_mapping:
         results = aggregate_clusters(results, args.cluster_mapping)
-    if args.pruned_ids:
-        results = filter_by_ids(results, args.pruned_ids)
-    out_writer.writerows(format_results(results))
+    # stream the rows out, filtering on the way
+    for row in results:
+        if args.pruned_ids is None or row["unique_id"] in args.pruned_ids:
+            out_writer.writerow(row)
     args.output.close()
 
 
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Binary container for the sequences of a cluster, so that they can be parsed once (by process_partis.py) and then
+memory-mapped by every script which needs them, rather than re-parsed from FASTA at each step.
+
+The file layout is:
+
+    MAGIC
+    8 byte little-endian header length
+    JSON header: {"ids": [...], "descriptions": [...], "lengths": [...], "shape": [n_seqs, n_columns]}
+    zero padding to an 8 byte boundary
+    n_seqs x n_columns uint8 matrix, one row per sequence
+
+Sequences shorter than n_columns (i.e. unaligned sequences) are padded with zero bytes, and their actual lengths are
+recorded in the header. `read_alignment` reads either this format or FASTA, so scripts can take either.
+
+Running this module as a script converts a container to FASTA, for external tools which need it (or with --ids, just
+lists its sequence ids).
+"""
+
+import argparse
+import json
+import struct
+
+import numpy
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+MAGIC = b"CFTALN01"
+_HEADER_LEN = struct.Struct("<Q")
+
+
+class Alignment(object):
+    "Sequences as the rows of a (possibly memory-mapped) uint8 matrix, with an id index"
+
+    def __init__(self, ids, matrix, lengths=None, descriptions=None):
+        self.ids = list(ids)
+        self.matrix = matrix
+        self.lengths = (
+            list(lengths) if lengths is not None else [matrix.shape[1]] * len(self.ids)
+        )
+        self.descriptions = (
+            list(descriptions) if descriptions is not None else list(self.ids)
+        )
+        self.index = {seqid: i for i, seqid in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, seqid):
+        return seqid in self.index
+
+    @property
+    def is_aligned(self):
+        return len(set(self.lengths)) <= 1
+
+    def row(self, i):
+        return self.matrix[i, : self.lengths[i]]
+
+    def seq(self, seqid):
+        return self.row(self.index[seqid]).tobytes().decode("ascii")
+
+    def seqs(self):
+        "(id, sequence string) pairs in order"
+        for i, seqid in enumerate(self.ids):
+            yield seqid, self.row(i).tobytes().decode("ascii")
+
+    def seqrecords(self):
+        for i, (seqid, seq) in enumerate(self.seqs()):
+            yield SeqRecord(Seq(seq), id=seqid, description=self.descriptions[i])
+
+    def subset(self, rows):
+        "A new Alignment of the given row indices (in the given order); the matrix is copied out of any memory map"
+        return Alignment(
+            [self.ids[i] for i in rows],
+            self.matrix[rows],
+            [self.lengths[i] for i in rows],
+            [self.descriptions[i] for i in rows],
+        )
+
+
+def from_seqs(seqs, descriptions=None):
+    "Build an in-memory Alignment from (id, sequence) pairs"
+    seqs = [(seqid, str(seq)) for seqid, seq in seqs]
+    lengths = [len(seq) for _, seq in seqs]
+    width = max(lengths) if lengths else 0
+    matrix = numpy.zeros((len(seqs), width), dtype=numpy.uint8)
+    for i, (_, seq) in enumerate(seqs):
+        matrix[i, : len(seq)] = numpy.frombuffer(seq.encode("ascii"), dtype=numpy.uint8)
+    return Alignment([seqid for seqid, _ in seqs], matrix, lengths, descriptions)
+
+
+def read_fasta(fname):
+    "Read a FASTA file into an in-memory Alignment (sequence ids are the first word of each header)"
+    headers, seqs = [], []
+    with open(fname) as fh:
+        for line in fh:
+            line = line.strip()
+            if line.startswith(">"):
+                headers.append(line[1:])
+                seqs.append([])
+            elif line:
+                seqs[-1].append(line)
+    return from_seqs(
+        [
+            (header.split(None, 1)[0] if header else header, "".join(seq_lines))
+            for header, seq_lines in zip(headers, seqs)
+        ],
+        descriptions=headers,
+    )
+
+
+def write_alignment(alignment, fname):
+    header = json.dumps(
+        {
+            "ids": alignment.ids,
+            "descriptions": alignment.descriptions,
+            "lengths": alignment.lengths,
+            "shape": list(alignment.matrix.shape),
+        }
+    ).encode("utf-8")
+    offset = len(MAGIC) + _HEADER_LEN.size + len(header)
+    with open(fname, "wb") as fh:
+        fh.write(MAGIC)
+        fh.write(_HEADER_LEN.pack(len(header)))
+        fh.write(header)
+        fh.write(b"\0" * (-offset % 8))
+        fh.write(numpy.ascontiguousarray(alignment.matrix, dtype=numpy.uint8).tobytes())
+
+
+def read_container(fname):
+    "Memory-map an alignment container written by write_alignment"
+    with open(fname, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not an alignment container".format(fname))
+        (header_len,) = _HEADER_LEN.unpack(fh.read(_HEADER_LEN.size))
+        header = json.loads(fh.read(header_len).decode("utf-8"))
+    offset = len(MAGIC) + _HEADER_LEN.size + header_len
+    offset += -offset % 8
+    shape = tuple(header["shape"])
+    if shape[0] * shape[1] == 0:
+        # numpy can't memory map an empty region
+        matrix = numpy.zeros(shape, dtype=numpy.uint8)
+    else:
+        matrix = numpy.memmap(
+            fname, dtype=numpy.uint8, mode="r", offset=offset, shape=shape
+        )
+    return Alignment(header["ids"], matrix, header["lengths"], header["descriptions"])
+
+
+def is_container(fname):
+    with open(fname, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def read_alignment(fname):
+    "Read sequences from either an alignment container or a FASTA file"
+    return read_container(fname) if is_container(fname) else read_fasta(fname)
+
+
+def write_fasta(alignment, handle):
+    for description, (_, seq) in zip(alignment.descriptions, alignment.seqs()):
+        handle.write(">{}\n{}\n".format(description, seq))
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("alignment", help="alignment container (or FASTA)")
+    parser.add_argument("fasta_out", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--ids",
+        action="store_true",
+        help="write just the sequence ids, one per line, instead of FASTA",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    alignment = read_alignment(args.alignment)
+    if args.ids:
+        args.fasta_out.writelines(seqid + "\n" for seqid in alignment.ids)
+    else:
+        write_fasta(alignment, args.fasta_out)
+    args.fasta_out.close()
+
+
+if __name__ == "__main__":
+    main()
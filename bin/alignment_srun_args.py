@@ -1,26 +1,42 @@
 #!/usr/bin/env python
 
 import argparse
-from Bio import SeqIO
+
+import alignment_io
 
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("seqs")
+    parser.add_argument("seqs", help="FASTA or alignment container")
+    parser.add_argument(
+        "--method",
+        choices=["muscle", "anchored"],
+        default="muscle",
+        help="alignment method, as passed to codon_align.py",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes used for anchored alignment",
+    )
     return parser.parse_args()
 
 
 def main():
     args = get_args()
-    seqs = SeqIO.parse(args.seqs, "fasta")
     # Can't exceed 32000 for memory without having to request a large node
-    n_seqs = 0
-    for seq in seqs:
-        n_seqs += 1
-    if n_seqs > 8000:
-        print "--exclusive ",
-    # add baseline of 1/2 a gig
-    mem_needed = 500 + int(n_seqs * 1.6)
+    n_seqs = len(alignment_io.read_alignment(args.seqs))
+    if args.method == "anchored":
+        # pairwise alignments against the anchor only need memory linear in the number of sequences, and just
+        # the cpus for the process pool
+        print "--cpus-per-task={} ".format(args.processes),
+        mem_needed = 500 + int(n_seqs * 0.2)
+    else:
+        if n_seqs > 8000:
+            print "--exclusive ",
+        # add baseline of 1/2 a gig
+        mem_needed = 500 + int(n_seqs * 1.6)
     if mem_needed > 32000:
         print "--partition=largenode ",
     print "--mem={} ".format(mem_needed),
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Anchored ("star") multiple sequence alignment of the sequences in a clonal family.
+
+Most sequences in a clonal family differ from the partis inferred naive sequence by only a few substitutions and
+indels, so rather than aligning all sequences against each other, each sequence is aligned pairwise against the
+naive (the anchor), and the pairwise alignments are merged into one alignment by padding every insertion relative
+to the anchor to its longest length. Sequences too divergent from the anchor to trust a single pairwise alignment
+are aligned together with the anchor using muscle, and merged in the same way. This is near-linear in the number
+of sequences, rather than quadratic.
+"""
+
+import multiprocessing
+
+from Bio import pairwise2
+from Bio.SubsMat.MatrixInfo import blosum62
+
+# (open, extend) penalties for protein alignment against the anchor
+gap_penalties = (-10, -1)
+
+
+def anchor_relative(aligned_anchor, aligned_seq):
+    """Describe a sequence's alignment to the anchor as `columns`, the character aligned to each anchor position
+    (possibly a gap), and `insertions`, the residues inserted before each anchor position (with one extra slot
+    for those after the last anchor position)."""
+    columns, insertions = [], [""]
+    for anchor_char, seq_char in zip(aligned_anchor, aligned_seq):
+        if anchor_char != "-":
+            columns.append(seq_char)
+            insertions.append("")
+        elif seq_char != "-":
+            insertions[-1] += seq_char
+    return columns, insertions
+
+
+def identity(aligned_anchor, aligned_seq):
+    "Fraction of columns which match, ignoring columns where either sequence overhangs the other"
+    aligned_cols = [
+        i
+        for i, chars in enumerate(zip(aligned_anchor, aligned_seq))
+        if "-" not in chars
+    ]
+    if not aligned_cols:
+        return 0.0
+    start, end = aligned_cols[0], aligned_cols[-1] + 1
+    matches = sum(
+        a == s and a != "-"
+        for a, s in zip(aligned_anchor[start:end], aligned_seq[start:end])
+    )
+    return float(matches) / (end - start)
+
+
+def align_to_anchor(anchor_and_seqrecord):
+    """Pairwise align one sequence against the anchor. Takes and returns tuples so it can be mapped over a process
+    pool."""
+    anchor, (seqid, seq) = anchor_and_seqrecord
+    aligned_anchor, aligned_seq = pairwise2.align.globalds(
+        anchor,
+        seq,
+        blosum62,
+        gap_penalties[0],
+        gap_penalties[1],
+        penalize_end_gaps=False,
+        one_alignment_only=True,
+    )[0][:2]
+    return (
+        seqid,
+        anchor_relative(aligned_anchor, aligned_seq),
+        identity(aligned_anchor, aligned_seq),
+    )
+
+
+def merge_star_alignment(anchor, relative_alignments):
+    """Merge (id, (columns, insertions)) alignments relative to the anchor into a single alignment, as an
+    (id, aligned_seq) list; the anchor itself isn't included."""
+    max_insertion_lens = [0] * (len(anchor) + 1)
+    for _, (_, insertions) in relative_alignments:
+        for i, insertion in enumerate(insertions):
+            max_insertion_lens[i] = max(max_insertion_lens[i], len(insertion))
+
+    def merged_row(columns, insertions):
+        row = []
+        for i, max_insertion_len in enumerate(max_insertion_lens):
+            row.append(insertions[i].ljust(max_insertion_len, "-"))
+            if i < len(columns):
+                row.append(columns[i])
+        return "".join(row)
+
+    anchor_row = merged_row(list(anchor), [""] * (len(anchor) + 1))
+    return anchor_row, [
+        (seqid, merged_row(columns, insertions))
+        for seqid, (columns, insertions) in relative_alignments
+    ]
+
+
+def anchored_alignment(
+    anchor_id, seqs, min_identity=0.8, processes=1, divergent_aligner=None
+):
+    """Align (id, seq) pairs `seqs` (which must include anchor_id) against the anchor sequence, returning an
+    (id, aligned_seq) list in input order. Sequences with less than min_identity to the anchor are instead aligned by
+    divergent_aligner (if given), which takes and returns (id, seq) pairs (with the anchor among them).
+    """
+    seqs = list(seqs)
+    anchor = dict(seqs)[anchor_id]
+    others = [(seqid, seq) for seqid, seq in seqs if seqid != anchor_id]
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+        try:
+            pairwise = pool.map(
+                align_to_anchor,
+                [(anchor, sr) for sr in others],
+                chunksize=max(1, len(others) // (4 * processes)),
+            )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        pairwise = [align_to_anchor((anchor, sr)) for sr in others]
+
+    relative_alignments = {
+        seqid: relative for seqid, relative, ident in pairwise if ident >= min_identity
+    }
+    divergent_ids = set(seqid for seqid, _, ident in pairwise if ident < min_identity)
+    if divergent_ids and divergent_aligner is not None:
+        aligned = dict(
+            divergent_aligner(
+                [(anchor_id, anchor)]
+                + [(seqid, seq) for seqid, seq in others if seqid in divergent_ids]
+            )
+        )
+        aligned_anchor = aligned.pop(anchor_id)
+        for seqid, aligned_seq in aligned.items():
+            relative_alignments[seqid] = anchor_relative(aligned_anchor, aligned_seq)
+    else:
+        # nothing better to do with them than keep their pairwise alignments
+        relative_alignments.update(
+            (seqid, relative)
+            for seqid, relative, _ in pairwise
+            if seqid in divergent_ids
+        )
+
+    anchor_row, rows = merge_star_alignment(
+        anchor, [(seqid, relative_alignments[seqid]) for seqid, _ in others]
+    )
+    rows = dict(rows)
+    rows[anchor_id] = anchor_row
+    return [(seqid, rows[seqid]) for seqid, _ in seqs]
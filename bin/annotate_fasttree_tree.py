@@ -1,14 +1,249 @@
 #!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Draw the FastTree tree of a cluster as a circular tree, with the sequences kept in pruning labeled in red (and the naive
+and seed in blue).
+
+The layout is computed directly from the array tree (see array_tree.py), and drawn to SVG as text, or to PNG with
+PIL, so no Qt or X server is needed. For large trees, subtrees containing none of the labeled sequences are collapsed
+into grey wedges (labeled with their number of leaves), so the drawing stays legible and fast however large the
+cluster.
+"""
+
+from __future__ import division
 
 import argparse
-import os
-from ete3 import Tree, TextFace, TreeStyle
+import math
+from warnings import warn
+from xml.sax.saxutils import escape
 
+import numpy
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description="Annotate FastTree tree with prune ids."
+import array_tree
+
+COLORS = {"highlight": "blue", "kept": "red", "other": "black", "collapsed": "grey"}
+ARC_STEP = math.radians(1)
+
+
+def reroot_on_leaf(tree, outgroup):
+    """The tree rerooted on the branch above the leaf outgroup, with outgroup as first child of the new root, halving
+    that branch between the two sides and splicing out the old root if it's left with a single child (as ete3's
+    set_outgroup)."""
+    neighbors = [[] for _ in range(len(tree))]
+    lengths = numpy.nan_to_num(tree.length)
+    for node in range(1, len(tree)):
+        parent = tree.parent[node]
+        neighbors[node].append((parent, lengths[node]))
+        neighbors[parent].append((node, lengths[node]))
+    half = lengths[outgroup] / 2
+    parent, length, names = [-1, 0], [numpy.nan, half], ["", tree.names[outgroup]]
+    # (node, node it was reached from, index of its parent in the new tree, length of the branch above it)
+    stack = [(tree.parent[outgroup], outgroup, 0, half)]
+    while stack:
+        node, came_from, new_parent, dist = stack.pop()
+        onward = [(n, l) for n, l in neighbors[node] if n != came_from]
+        if len(onward) == 1:
+            # a unifurcation (the old root); merge its branches
+            next_node, next_dist = onward[0]
+            stack.append((next_node, node, new_parent, dist + next_dist))
+            continue
+        parent.append(new_parent)
+        length.append(dist)
+        names.append(tree.names[node])
+        new_index = len(parent) - 1
+        stack.extend((n, node, new_index, l) for n, l in reversed(onward))
+    return array_tree.ArrayTree(parent, length, names)
+
+
+def layout(tree, labeled, collapse=True):
+    """Circular layout of the tree, with the labeled nodes drawn individually. Returns the angle, radius and number
+    of leaves of every node, the drawn nodes (in preorder), the collapsed nodes with the angle range and maximum radius
+    of each wedge, and the children of every node."""
+    n = len(tree)
+    children = tree.children()
+    radius = tree.root_distances()
+    n_leaves = tree.is_leaf.astype(numpy.int64)
+    max_radius = radius.copy()
+    has_labeled = numpy.zeros(n, dtype=bool)
+    has_labeled[list(labeled)] = True
+    # children follow their parents, so one reverse pass accumulates subtrees
+    for node in range(n - 1, 0, -1):
+        parent = tree.parent[node]
+        n_leaves[parent] += n_leaves[node]
+        max_radius[parent] = max(max_radius[parent], max_radius[node])
+        has_labeled[parent] |= has_labeled[node]
+
+    # walk the tree in preorder, stopping at collapsed subtrees, laying the tips out around the circle weighted by size
+    drawn, tips, weights, collapsed = [], [], [], {}
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        drawn.append(node)
+        if collapse and node != 0 and not has_labeled[node] and children[node]:
+            collapsed[node] = None
+            tips.append(node)
+            weights.append(1 + math.log(n_leaves[node], 2))
+        elif not children[node]:
+            tips.append(node)
+            weights.append(1.0)
+        else:
+            stack.extend(reversed(children[node]))
+    bounds = numpy.concatenate([[0], numpy.cumsum(weights)]) * (
+        2 * math.pi / sum(weights)
+    )
+    angle = numpy.zeros(n)
+    for i, tip in enumerate(tips):
+        angle[tip] = (bounds[i] + bounds[i + 1]) / 2
+        if tip in collapsed:
+            collapsed[tip] = (bounds[i], bounds[i + 1], max_radius[tip])
+    for node in reversed(drawn):
+        if children[node] and node not in collapsed:
+            angle[node] = (angle[children[node][0]] + angle[children[node][-1]]) / 2
+    return angle, radius, n_leaves, drawn, collapsed, children
+
+
+class Canvas(object):
+    "Collects drawing primitives in polar coordinates, to be written to SVG or PNG"
+
+    def __init__(self, size, max_radius, label_margin):
+        self.size = size
+        self.center = size / 2
+        self.scale = (size / 2 - label_margin) / (max_radius or 1.0)
+        self.lines, self.polygons, self.texts = [], [], []
+
+    def point(self, r, theta):
+        r = r * self.scale
+        return (self.center + r * math.cos(theta), self.center + r * math.sin(theta))
+
+    def line(self, r1, r2, theta, color="black"):
+        self.lines.append(([self.point(r1, theta), self.point(r2, theta)], color))
+
+    def arc(self, r, theta1, theta2, color="black"):
+        n_steps = max(1, int(abs(theta2 - theta1) / ARC_STEP))
+        self.lines.append(
+            (
+                [
+                    self.point(r, theta1 + (theta2 - theta1) * i / n_steps)
+                    for i in range(n_steps + 1)
+                ],
+                color,
+            )
+        )
+
+    def wedge(self, r1, r2, theta1, theta2, color="lightgrey"):
+        n_steps = max(1, int(abs(theta2 - theta1) / ARC_STEP))
+        self.polygons.append(
+            (
+                [self.point(r1, (theta1 + theta2) / 2)]
+                + [
+                    self.point(r2, theta1 + (theta2 - theta1) * i / n_steps)
+                    for i in range(n_steps + 1)
+                ],
+                color,
+            )
+        )
+
+    def text(self, r, theta, label, color="black"):
+        x, y = self.point(r, theta)
+        self.texts.append((x, y, math.degrees(theta), label, color))
+
+    def write_svg(self, outfile, font_size=6):
+        outfile.write(
+            '<svg xmlns="http://www.w3.org/2000/svg" width="{0}" height="{0}" viewBox="0 0 {0} {0}">\n'.format(
+                self.size
+            )
+        )
+        outfile.write('<rect width="100%" height="100%" fill="white"/>\n')
+        for points, color in self.polygons:
+            outfile.write(
+                '<polygon points="{}" fill="{}" stroke="none"/>\n'.format(
+                    " ".join("{:.2f},{:.2f}".format(x, y) for x, y in points), color
+                )
+            )
+        for points, color in self.lines:
+            outfile.write(
+                '<polyline points="{}" fill="none" stroke="{}" stroke-width="0.5"/>\n'.format(
+                    " ".join("{:.2f},{:.2f}".format(x, y) for x, y in points), color
+                )
+            )
+        for x, y, degrees, label, color in self.texts:
+            # keep text upright on the left side of the circle
+            flip = 90 < degrees % 360 < 270
+            outfile.write(
+                '<text x="{:.2f}" y="{:.2f}" font-size="{}" fill="{}" dominant-baseline="middle"'
+                ' text-anchor="{}" transform="rotate({:.2f} {:.2f} {:.2f})">{}</text>\n'.format(
+                    x,
+                    y,
+                    font_size,
+                    color,
+                    "end" if flip else "start",
+                    degrees + 180 if flip else degrees,
+                    x,
+                    y,
+                    escape(label),
+                )
+            )
+        outfile.write("</svg>\n")
+
+    def write_png(self, fname):
+        from PIL import Image, ImageDraw
+
+        image = Image.new("RGB", (self.size, self.size), "white")
+        draw = ImageDraw.Draw(image)
+        for points, color in self.polygons:
+            draw.polygon(points, fill=color)
+        for points, color in self.lines:
+            draw.line(points, fill=color, width=1)
+        for x, y, degrees, label, color in self.texts:
+            # PIL can't easily rotate text, so labels are written horizontally, outwards from the circle
+            width, height = draw.textsize(label)
+            if 90 < degrees % 360 < 270:
+                x -= width
+            draw.text((x, y - height / 2), label, fill=color)
+        image.save(fname)
+
+
+def draw_tree(tree, kept_ids, highlight_ids, size=900, max_drawn_leaves=1000):
+    leaves = numpy.flatnonzero(tree.is_leaf)
+    category = {}
+    for leaf in leaves:
+        name = tree.names[leaf]
+        if name in highlight_ids:
+            category[leaf] = "highlight"
+        elif name in kept_ids:
+            category[leaf] = "kept"
+    angle, radius, n_leaves, drawn, collapsed, children = layout(
+        tree, list(category), collapse=len(leaves) > max_drawn_leaves
     )
+    canvas = Canvas(size, radius.max(), label_margin=size * 0.15)
+    for node in drawn:
+        if node != 0:
+            canvas.line(radius[tree.parent[node]], radius[node], angle[node])
+        if node in collapsed:
+            theta1, theta2, max_radius = collapsed[node]
+            canvas.wedge(radius[node], max_radius, theta1, theta2)
+            canvas.text(
+                max_radius,
+                angle[node],
+                " ({})".format(n_leaves[node]),
+                COLORS["collapsed"],
+            )
+        elif children[node]:
+            canvas.arc(
+                radius[node], angle[children[node][0]], angle[children[node][-1]]
+            )
+        else:
+            canvas.text(
+                radius[node],
+                angle[node],
+                " " + tree.names[node],
+                COLORS[category.get(node, "other")],
+            )
+    return canvas
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("tree_path", type=str, help="Path to FastTree tree file.")
     parser.add_argument("ids_path", type=str, help="Path to prune id file.")
     parser.add_argument(
@@ -16,33 +251,46 @@ if __name__ == "__main__":
     )
     parser.add_argument("--seed", type=str, help="The name of the seed sequence.")
     parser.add_argument(
-        "--output-path", type=str, required=True, help="The PNG output file path."
+        "--output-path",
+        type=str,
+        required=True,
+        help="The output file path; SVG if it ends in .svg, and PNG otherwise.",
     )
     parser.add_argument("--size", type=int, default=900, help="size in pixels of png")
+    parser.add_argument(
+        "--max-drawn-leaves",
+        type=int,
+        default=1000,
+        help="for trees with more leaves than this, collapse subtrees containing no pruned ids",
+    )
+    return parser.parse_args()
 
-    args = parser.parse_args()
 
-    tree = Tree(args.tree_path, format=1)
-    tree.set_outgroup(tree & args.naive)
+def main():
+    args = get_args()
+    tree = array_tree.load(args.tree_path)
+    if args.naive in tree.names:
+        tree = reroot_on_leaf(tree, tree.names.index(args.naive))
+    else:
+        warn(
+            "naive sequence {} is not in {}; drawing the tree with its original root".format(
+                args.naive, args.tree_path
+            )
+        )
 
     with open(args.ids_path) as f:
-        ids = f.readlines()
-    ids = [id.rstrip("\n") for id in ids]
-
-    for leaf_node in tree.get_leaves():
-        if leaf_node.name in ([args.naive, args.seed] if args.seed else [args.naive]):
-            color = "blue"
-        elif leaf_node.name in ids:
-            color = "red"
-        else:
-            color = "black"
+        ids = set(line.rstrip("\n") for line in f)
+    highlight_ids = set([args.naive, args.seed] if args.seed else [args.naive])
 
-        node_face = TextFace(leaf_node.name, fsize=6, fgcolor=color)
-        leaf_node.add_face(node_face, column=0, position="float")
+    canvas = draw_tree(
+        tree, ids, highlight_ids, args.size, max_drawn_leaves=args.max_drawn_leaves
+    )
+    if args.output_path.endswith(".svg"):
+        with open(args.output_path, "w") as outfile:
+            canvas.write_svg(outfile)
+    else:
+        canvas.write_png(args.output_path)
 
-    ts = TreeStyle()
-    ts.mode = "c"
-    ts.show_leaf_name = False
-    ts.show_scale = False
 
-    tree.render(args.output_path, tree_style=ts, w=args.size)
+if __name__ == "__main__":
+    main()
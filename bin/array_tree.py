@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Trees as flat arrays, parsed once from newick and cached in a binary sidecar, for the scripts which read the (large)
+FastTree tree.
+
+An ArrayTree stores its nodes in preorder (so every parent precedes its children) as
+
+    parent: index of each node's parent (-1 for the root)
+    length: length of the branch above each node (nan where the newick gives none)
+    names: name of each node ("" where the newick gives none; for FastTree these are support values on internal nodes)
+
+Newick text is parsed with a single regex tokenizer and an explicit stack, so deep (ladder-like) trees don't hit the
+recursion limit. The parsed arrays are saved to `<tree>.npz`, and `load` reuses them as long as the tree file hasn't
+changed since, so consumers of a tree skip parsing entirely. Adapters build ete3 trees from the
+arrays for scripts that still need ete3's tree operations.
+
+Running this module as a script parses a tree and writes its sidecar.
+"""
+
+from __future__ import division
+
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+
+import numpy
+
+SIDECAR_SUFFIX = ".npz"
+_TOKEN = re.compile(
+    r"\s*(?:([(),;])|:\s*([^\s(),:;\[]+)|'((?:[^']|'')*)'|([^\s(),:;'\[]+)|\[[^\]]*\])"
+)
+
+
+class ArrayTree(object):
+    def __init__(self, parent, length, names):
+        self.parent = numpy.asarray(parent, dtype=numpy.int64)
+        self.length = numpy.asarray(length, dtype=numpy.float64)
+        self.names = list(names)
+        self._n_children = None
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def n_children(self):
+        if self._n_children is None:
+            self._n_children = numpy.bincount(
+                self.parent[1:], minlength=len(self)
+            ).astype(numpy.int64)
+        return self._n_children
+
+    @property
+    def is_leaf(self):
+        return self.n_children == 0
+
+    @property
+    def n_leaves(self):
+        return int(self.is_leaf.sum())
+
+    def leaf_names(self):
+        "Names of the leaves, in newick (preorder) order"
+        return [self.names[i] for i in numpy.flatnonzero(self.is_leaf)]
+
+    def children(self):
+        "List of child indices for each node"
+        children = [[] for _ in range(len(self))]
+        for child, parent in enumerate(self.parent):
+            if parent >= 0:
+                children[parent].append(child)
+        return children
+
+    def root_distances(self):
+        "Distance from the root to each node, treating missing branch lengths as 0"
+        lengths = numpy.nan_to_num(self.length)
+        dist = numpy.zeros(len(self))
+        # parents precede children, so one pass in order suffices
+        for i in range(1, len(self)):
+            dist[i] = dist[self.parent[i]] + lengths[i]
+        return dist
+
+    def to_ete3(self):
+        """An ete3 Tree equivalent to parsing the newick with `ete3.Tree(newick, format=1)` (missing branch lengths
+        default to 1, except at the root)"""
+        import ete3
+
+        nodes = [ete3.Tree(name=self.names[0], dist=0.0)]
+        if not numpy.isnan(self.length[0]):
+            nodes[0].dist = float(self.length[0])
+        for i in range(1, len(self)):
+            dist = 1.0 if numpy.isnan(self.length[i]) else float(self.length[i])
+            nodes.append(nodes[self.parent[i]].add_child(name=self.names[i], dist=dist))
+        return nodes[0]
+
+
+def parse_newick(text):
+    "Parse the first tree of a newick string into an ArrayTree"
+    parent, length, names = [], [], []
+    # open internal nodes, innermost last
+    stack = []
+    # the node that a following name or length applies to, unless a new child is expected
+    current = None
+    expect_child = True
+
+    def add_node():
+        parent.append(stack[-1] if stack else -1)
+        length.append(numpy.nan)
+        names.append("")
+        return len(parent) - 1
+
+    pos = 0
+    for m in _TOKEN.finditer(text):
+        if text[pos : m.start()].strip():
+            raise ValueError("unparseable newick at character {}".format(pos))
+        pos = m.end()
+        punct, branch_length, quoted, name = m.groups()
+        if punct == "(":
+            stack.append(add_node())
+            expect_child = True
+            continue
+        if punct in (",", ")") or branch_length is not None or quoted or name:
+            if expect_child:
+                if not stack and parent:
+                    raise ValueError("newick has more than one root")
+                current = add_node()
+                expect_child = False
+        if punct == ",":
+            expect_child = True
+        elif punct == ")":
+            current = stack.pop()
+        elif punct == ";":
+            break
+        elif branch_length is not None:
+            length[current] = float(branch_length)
+        elif quoted is not None:
+            names[current] = quoted.replace("''", "'")
+        elif name is not None:
+            names[current] = name
+    if stack or not parent:
+        raise ValueError("incomplete newick tree")
+    return ArrayTree(parent, length, names)
+
+
+def read_newick(fname):
+    with open(fname) as fh:
+        return parse_newick(fh.read())
+
+
+def sidecar_fname(fname):
+    return fname + SIDECAR_SUFFIX
+
+
+def file_digest(fname):
+    with open(fname, "rb") as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+def save(tree, fname, digest=""):
+    """Save tree to fname (an npz file), recording the digest of the newick it came from. The file is written under a
+    temporary name and renamed into place, so concurrent readers never see it partially written.
+    """
+    names = "\n".join(tree.names)
+    if not isinstance(names, bytes):
+        names = names.encode("utf-8")
+    fd, tmp_fname = tempfile.mkstemp(
+        dir=os.path.dirname(fname) or ".", prefix=".tmp-", suffix=SIDECAR_SUFFIX
+    )
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            numpy.savez(
+                fh,
+                parent=tree.parent,
+                length=tree.length,
+                names=numpy.frombuffer(names, dtype=numpy.uint8),
+                digest=numpy.frombuffer(digest.encode("ascii"), dtype=numpy.uint8),
+            )
+        os.rename(tmp_fname, fname)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
+
+def load_sidecar(fname, digest=None):
+    "Load a tree saved by save, returning None if it doesn't exist or (given a digest) is for a different newick"
+    try:
+        data = numpy.load(fname)
+    except (IOError, OSError, ValueError):
+        return None
+    if digest is not None and data["digest"].tobytes().decode("ascii") != digest:
+        return None
+    # names come back as the native str type, as from parsing
+    names = data["names"].tobytes()
+    if not isinstance(names, str):
+        names = names.decode("utf-8")
+    return ArrayTree(data["parent"], data["length"], names.split("\n"))
+
+
+def load(fname, write_sidecar=False):
+    """Load the newick tree in fname as an ArrayTree, from its sidecar if that is up to date, and otherwise by parsing
+    the newick (and, with write_sidecar, saving the result as the sidecar for next time, where the directory is
+    writable). The build writes each sidecar as a target of its own, by running this module as a script, so that its
+    consumers only ever read it.
+    """
+    digest = file_digest(fname)
+    tree = load_sidecar(sidecar_fname(fname), digest)
+    if tree is None:
+        tree = read_newick(fname)
+        if write_sidecar:
+            try:
+                save(tree, sidecar_fname(fname), digest)
+            except (IOError, OSError):
+                pass
+    return tree
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tree", help="newick tree file")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    tree = load(args.tree, write_sidecar=True)
+    print("{}: {} nodes, {} leaves".format(args.tree, len(tree), tree.n_leaves))
+
+
+if __name__ == "__main__":
+    main()
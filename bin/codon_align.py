@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Codon-aware alignment of (indel containing) cluster sequences, all in one process: translate the sequences,
+align the translations with muscle, and backtranslate the protein alignment into a nucleotide alignment.
+
+Muscle alignments are cached by content in --cache-dir (a result store; see result_store.py), keyed on the muscle
+version and the set of (id, translated sequence) pairs being aligned, so that identical clusters (e.g. across partition steps, seeds or
+reruns) are only aligned once.
+"""
+
+import argparse
+import hashlib
+import subprocess
+import sys
+import tempfile
+import warnings
+
+from Bio import SeqIO
+from Bio.Seq import Seq
+from Bio.SeqRecord import SeqRecord
+
+import alignment_io
+import anchored_align
+import result_store
+import translate_seqs
+import translation
+
+
+def muscle_version():
+    return subprocess.check_output(["muscle", "-version"]).strip()
+
+
+def alignment_cache_key(seqrecords, version):
+    "Hash of the set of (id, sequence) pairs to be aligned, so that input order doesn't matter"
+    digest = hashlib.sha1(version)
+    for seqid, seq in sorted((sr.id, str(sr.seq)) for sr in seqrecords):
+        digest.update("{}\t{}\n".format(seqid, seq))
+    return digest.hexdigest()
+
+
+def run_muscle(seqrecords, out_fname):
+    with tempfile.NamedTemporaryFile(suffix=".fa") as infile:
+        SeqIO.write(seqrecords, infile, "fasta")
+        infile.flush()
+        subprocess.check_call(["muscle", "-in", infile.name, "-out", out_fname])
+
+
+def stops_as_x(seqrecords):
+    """Replace stop codons with X, or muscle inserts gaps, which messes up backtranslation.
+    Note that things will break down at backtranslation if any seq ids have * in them...
+    """
+    return [
+        SeqRecord(Seq(str(sr.seq).replace("*", "X")), id=sr.id, description="")
+        for sr in seqrecords
+    ]
+
+
+def cached_muscle(seqrecords, out_fname, store=None, max_size=None):
+    """Align seqrecords with muscle, writing the alignment to out_fname. If a result store directory is given, reuse
+    (or store) the alignment of an identical set of sequences."""
+    seqrecords = stops_as_x(seqrecords)
+    if not store:
+        run_muscle(seqrecords, out_fname)
+        return
+    key = alignment_cache_key(seqrecords, muscle_version())
+    if result_store.fetch(store, key, [out_fname]):
+        sys.stderr.write(
+            "using stored muscle alignment {}\n".format(
+                result_store.entry_dir(store, key)
+            )
+        )
+    else:
+        run_muscle(seqrecords, out_fname)
+        result_store.put(store, key, [out_fname], max_size)
+
+
+def muscle_aligner(store=None, max_size=None):
+    "Returns a function aligning (id, seq) pairs with (cached) muscle, for aligning divergent anchored sequences"
+
+    def align(seqs):
+        with tempfile.NamedTemporaryFile(suffix=".fa") as outfile:
+            cached_muscle(
+                [SeqRecord(Seq(seq), id=seqid, description="") for seqid, seq in seqs],
+                outfile.name,
+                store,
+                max_size,
+            )
+            return [(sr.id, str(sr.seq)) for sr in SeqIO.parse(outfile.name, "fasta")]
+
+    return align
+
+
+def align_anchored(
+    seqrecords,
+    out_fname,
+    anchor_id,
+    min_identity,
+    processes,
+    store=None,
+    max_size=None,
+):
+    """Align seqrecords against the anchor sequence (see anchored_align.py), falling back to muscle for those too
+    divergent from it, and write the alignment to out_fname."""
+    aligned = anchored_align.anchored_alignment(
+        anchor_id,
+        [(sr.id, str(sr.seq)) for sr in stops_as_x(seqrecords)],
+        min_identity=min_identity,
+        processes=processes,
+        divergent_aligner=muscle_aligner(store, max_size),
+    )
+    SeqIO.write(
+        (SeqRecord(Seq(seq), id=seqid, description="") for seqid, seq in aligned),
+        out_fname,
+        "fasta",
+    )
+
+
+def backtranslate_seq(aligned_aa_seq, nt_seq, mismatch_action="warn"):
+    """Thread the codons of (ungapped) nt_seq through aligned_aa_seq, turning each gap into a gap codon. Codons which
+    don't translate to the amino acid they are aligned to are handled according to mismatch_action, as in seqmagick
+    backtrans-align: 'fail', 'warn' or 'none'."""
+    nt_seq = str(nt_seq).replace("-", "")
+    codons = [nt_seq[i : i + 3] for i in range(0, len(nt_seq) - len(nt_seq) % 3, 3)]
+    aligned_codons = []
+    icodon = 0
+    for aa in str(aligned_aa_seq):
+        if aa == "-":
+            aligned_codons.append("---")
+            continue
+        if icodon >= len(codons):
+            raise ValueError(
+                "ran out of codons backtranslating aligned protein sequence {}".format(
+                    aligned_aa_seq
+                )
+            )
+        codon = codons[icodon]
+        aligned_codons.append(codon)
+        icodon += 1
+        translated_aa = translation.translate_codon(codon.upper())
+        # muscle has seen stop codons as X (see cached_muscle), and an X in the alignment could be anything
+        if aa.upper() not in (translated_aa, "X") and mismatch_action != "none":
+            message = "codon {} translates to {}, not {}".format(
+                codon, translated_aa, aa
+            )
+            if mismatch_action == "fail":
+                raise ValueError(message)
+            warnings.warn(message)
+    if icodon != len(codons) and mismatch_action != "none":
+        message = "{} codons left over after backtranslating aligned protein sequence {}".format(
+            len(codons) - icodon, aligned_aa_seq
+        )
+        if mismatch_action == "fail":
+            raise ValueError(message)
+        warnings.warn(message)
+    return "".join(aligned_codons)
+
+
+def backtranslate(aligned_aa_records, nt_records, mismatch_action="warn"):
+    """Backtranslate a protein alignment into a nucleotide alignment, matching up sequences by id, and yielding the
+    aligned nucleotide records sorted by id."""
+    nt_seqs = {sr.id: sr.seq for sr in nt_records}
+    for aa_record in sorted(aligned_aa_records, key=lambda sr: sr.id):
+        if aa_record.id not in nt_seqs:
+            raise ValueError(
+                "no nucleotide sequence for aligned protein sequence {}".format(
+                    aa_record.id
+                )
+            )
+        yield SeqRecord(
+            Seq(
+                backtranslate_seq(aa_record.seq, nt_seqs[aa_record.id], mismatch_action)
+            ),
+            id=aa_record.id,
+            description="",
+        )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "metadata",
+        type=argparse.FileType("r"),
+        help="partis_metadata.json or cluster signature for the cluster, which tells us the reading frame",
+    )
+    parser.add_argument(
+        "inseqs",
+        type=lambda x: list(alignment_io.read_alignment(x).seqrecords()),
+        help="FASTA or alignment container",
+    )
+    parser.add_argument("--translated-out", required=True)
+    parser.add_argument(
+        "--trimmed-out",
+        required=True,
+        help="inseqs trimmed to the reading frame, to be backtranslated",
+    )
+    parser.add_argument("--aligned-translated-out", required=True)
+    parser.add_argument("--aligned-out", required=True)
+    parser.add_argument(
+        "--cache-dir",
+        help="directory in which to cache muscle alignments (a result store; see result_store.py)",
+    )
+    parser.add_argument(
+        "--cache-max-size",
+        type=float,
+        default=result_store.DEFAULT_MAX_SIZE_GB,
+        help="size (in GB) to evict the cache down to after adding alignments",
+    )
+    parser.add_argument(
+        "--method",
+        choices=["muscle", "anchored"],
+        default="muscle",
+        help="""align all translated sequences with muscle, or align each one against the translated --anchor-id
+        sequence and merge the results, only using muscle for sequences too divergent from the anchor""",
+    )
+    parser.add_argument(
+        "--anchor-id",
+        help="id of the anchor sequence (e.g. the inferred naive) for --method anchored",
+    )
+    parser.add_argument(
+        "--min-anchor-identity",
+        type=float,
+        default=0.8,
+        help="sequences with less amino acid identity than this to the anchor get aligned with muscle",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes to use for pairwise alignment against the anchor",
+    )
+    parser.add_argument(
+        "-a",
+        "--mismatch-action",
+        choices=["fail", "warn", "none"],
+        default="warn",
+        help="what to do about codons which don't translate to their aligned amino acid",
+    )
+    args = parser.parse_args()
+    if args.method == "anchored" and args.anchor_id is None:
+        parser.error("--anchor-id is required for --method anchored")
+    return args
+
+
+def main():
+    args = get_args()
+    max_size = int(args.cache_max_size * 1e9)
+    frame = translate_seqs.get_frame(args.metadata)
+    translated = list(translate_seqs.translate_seqrecords(args.inseqs, frame))
+    trimmed = list(translate_seqs.trim_seqrecords(args.inseqs, frame))
+    SeqIO.write(translated, args.translated_out, "fasta")
+    SeqIO.write(trimmed, args.trimmed_out, "fasta")
+
+    if args.method == "anchored":
+        align_anchored(
+            translated,
+            args.aligned_translated_out,
+            args.anchor_id,
+            args.min_anchor_identity,
+            args.processes,
+            args.cache_dir,
+            max_size,
+        )
+    else:
+        cached_muscle(translated, args.aligned_translated_out, args.cache_dir, max_size)
+    aligned_translated = SeqIO.parse(args.aligned_translated_out, "fasta")
+    SeqIO.write(
+        backtranslate(aligned_translated, trimmed, args.mismatch_action),
+        args.aligned_out,
+        "fasta",
+    )
+
+
+if __name__ == "__main__":
+    main()
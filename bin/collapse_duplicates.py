@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Collapse identical aligned sequences of a cluster into a single representative (the first of them in the alignment),
+so that tree building and pruning only see each distinct sequence once.
+
+The representative's row of the sequence metadata carries the summed multiplicities (in total and by timepoint) of
+all the sequences collapsed into it, as for the sequences of a min-adcl cluster (see
+aggregate_minadcl_cluster_multiplicities.py), and its duplicates list the ids of the collapsed sequences along with
+their duplicates. The naive and any --always-include ids (e.g.
+seeds) are never collapsed, so they remain as tips of their own.
+"""
+
+import argparse
+import csv
+
+import numpy
+
+import aggregate_minadcl_cluster_multiplicities as aggregate
+import alignment_io
+
+
+def representatives(alignment, always_include=()):
+    """Index of the representative of each row of the alignment; identical rows are found by sorting the alignment
+    matrix, rather than comparing sequences pairwise."""
+    if not alignment.is_aligned:
+        raise ValueError("sequences to collapse are not all the same length")
+    reps = numpy.arange(len(alignment))
+    rows = numpy.array(
+        [i for i, seqid in enumerate(alignment.ids) if seqid not in always_include],
+        dtype=numpy.int64,
+    )
+    if len(rows):
+        _, first, inverse = numpy.unique(
+            numpy.asarray(alignment.matrix[rows]),
+            axis=0,
+            return_index=True,
+            return_inverse=True,
+        )
+        reps[rows] = rows[first][inverse]
+    return reps
+
+
+def collapse(alignment, seqmeta, always_include=()):
+    """Returns the alignment of representatives (in alignment order), and their seqmeta rows with multiplicities,
+    timepoint multiplicities and duplicates aggregated over the sequences collapsed into them.
+    """
+    reps = representatives(alignment, always_include)
+    collapsed = alignment.subset(numpy.flatnonzero(reps == numpy.arange(len(reps))))
+    mapping = [(alignment.ids[rep], seqid) for seqid, rep in zip(alignment.ids, reps)]
+    rows = []
+    for row in aggregate.aggregate_clusters(seqmeta, mapping, include_members=True):
+        row.update(
+            {
+                "multiplicity": row.pop("cluster_multiplicity"),
+                "timepoints": row.pop("cluster_timepoints"),
+                "timepoint_multiplicities": row.pop("cluster_timepoint_multiplicities"),
+                "duplicates": row.pop("cluster_duplicates"),
+            }
+        )
+        rows.append(row)
+    return collapsed, rows
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("alignment", help="aligned fasta, or alignment container")
+    parser.add_argument(
+        "partis_seqmeta", help="sequence metadata from process_partis.py"
+    )
+    parser.add_argument("collapsed_seqs", type=argparse.FileType("w"))
+    parser.add_argument("collapsed_seqmeta", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--always-include",
+        type=lambda x: x.split(","),
+        default=[],
+        help="comma separated list of ids never to collapse",
+    )
+    parser.add_argument("--inferred-naive-name", default="inferred_naive")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    with open(args.partis_seqmeta) as fh:
+        reader = csv.DictReader(fh)
+        fieldnames = reader.fieldnames
+        seqmeta = list(reader)
+    collapsed, rows = collapse(
+        alignment_io.read_alignment(args.alignment),
+        seqmeta,
+        set(args.always_include + [args.inferred_naive_name]),
+    )
+    alignment_io.write_fasta(collapsed, args.collapsed_seqs)
+    args.collapsed_seqs.close()
+    writer = csv.DictWriter(
+        args.collapsed_seqmeta, fieldnames=fieldnames, extrasaction="ignore"
+    )
+    writer.writeheader()
+    writer.writerows(rows)
+    args.collapsed_seqmeta.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 #!/usr/bin/env python
 
 import argparse
-import subprocess
+import numpy
 import weblogolib as w
 import os
 import sys
+from warnings import warn
 
 default_partis_path = os.path.join(os.getcwd(), "partis")
 partis_path = os.environ.get("PARTIS", default_partis_path)
@@ -12,16 +13,6 @@ sys.path.append(os.path.join(partis_path, "python"))
 import utils as partisutils
 
 
-def write_seq_according_to_probability(seq, probability, f):
-    """
-    Write the sequences into fastas according to their probability; this happens because the logo package
-    draws the height of the character according to its multiplicity at that site among the sequences in the file you give it
-    """
-    sig_figs = 3
-    for _ in range(int(probability * 10 ** sig_figs)):
-        f.write(">%s\n%s\n" % ("naive_w_probability_{}".format(probability), seq))
-
-
 def alternative_naives_with_probabilities(f):
     """
     Create seq, probability tuples by reading the ranked naive probabilities fasta
@@ -32,46 +23,50 @@ def alternative_naives_with_probabilities(f):
     ]
 
 
-def write_logo_input(
-    alternative_naives,
-    logo_input_fname,
-    cdr3_logo_input_fname,
-    aa_cdr3_start,
-    aa_cdr3_end,
-    aa_naive_len,
-):
+def weighted_counts(weighted_seqs, alphabet):
     """
-    Create logo input fastas for full seqs and CDR3 seqs. See write_seq_according_to_probability() for details on how 
-    weblogo wants these files to look.
+    Per-site counts of each character of alphabet among (seq, weight) pairs, each sequence counting as its weight. This
+    is the count matrix weblogo would get from a fasta with each sequence repeated in proportion to its weight, so the
+    logo's character heights reflect the probabilities of the alternative naive sequences.
     """
-    with open(logo_input_fname, "w") as logo_input, open(
-        cdr3_logo_input_fname, "w"
-    ) as cdr3_logo_input:
-        for aa_seq, probability in alternative_naives:
-            write_seq_according_to_probability(aa_seq, probability, logo_input)
-            # We are using the v and j codon position annotations from the most probable naive, so warn if one of the alternatives is not the same length since this could mess up the cdr3 start and end.
-            if len(aa_seq) != aa_naive_len:
-                warn(
-                    "Skipping: alternative naive sequence with length %d; differs in length from most probable naive sequence with length %d"
-                    % (len(aa_seq), aa_naive_len)
-                )
-                continue
-            aa_cdr3 = aa_seq[aa_cdr3_start:aa_cdr3_end]
-            write_seq_according_to_probability(aa_cdr3, probability, cdr3_logo_input)
-
-
-def create_logo(input_seqs_fname, logo_fname, options):
+    lengths = set(len(seq) for seq, _ in weighted_seqs)
+    if len(lengths) != 1:
+        raise ValueError("logo sequences must all be the same length")
+    counts = numpy.zeros((lengths.pop(), len(alphabet)))
+    for seq, weight in weighted_seqs:
+        ords = numpy.asarray(alphabet.ords(seq))
+        # characters outside the alphabet (e.g. gaps) aren't counted, as by LogoData.from_seqs
+        in_alphabet = ords < len(alphabet)
+        counts[numpy.flatnonzero(in_alphabet), ords[in_alphabet]] += weight
+    return counts
+
+
+def logo_inputs(alternative_naives, aa_cdr3_start, aa_cdr3_end, aa_naive_len):
     """
-    Create a logo plot png using weblogo from a fasta created with write_logo_input()
+    (seq, probability) pairs for the full seq and CDR3 logos.
     """
-    with open(input_seqs_fname, "rU") as f:
-        seqs = w.read_seq_data(f)
-    data = w.LogoData.from_seqs(seqs)
-
-    subprocess.check_call(("rm " + input_seqs_fname).split())
-
+    cdr3_naives = []
+    for aa_seq, probability in alternative_naives:
+        # We are using the v and j codon position annotations from the most probable naive, so warn if one of the alternatives is not the same length since this could mess up the cdr3 start and end.
+        if len(aa_seq) != aa_naive_len:
+            warn(
+                "Skipping: alternative naive sequence with length %d; differs in length from most probable naive sequence with length %d"
+                % (len(aa_seq), aa_naive_len)
+            )
+            continue
+        cdr3_naives.append((aa_seq[aa_cdr3_start:aa_cdr3_end], probability))
+    return alternative_naives, cdr3_naives
+
+
+def create_logo(
+    weighted_seqs, logo_fname, options, alphabet=w.std_alphabets["protein"]
+):
+    """
+    Create a logo plot png using weblogo from (seq, probability) pairs
+    """
+    data = w.LogoData.from_counts(alphabet, weighted_counts(weighted_seqs, alphabet))
     format = w.LogoFormat(data, options)
-    with open(logo_fname, "w") as f:
+    with open(logo_fname, "wb") as f:
         f.write(w.png_print_formatter(data, format))
 
 
@@ -82,7 +77,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "input_fasta_path",
         type=str,
-        help="Path to file with all potential partis naive seqs; their frequency in this file should represent their probability.",
+        help="Path to file with all potential partis naive seqs, named with their probabilities as `<name>_probability_<probability>`.",
     )
     parser.add_argument(
         "--aa-cdr3-start",
@@ -124,13 +119,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     alternative_naives = alternative_naives_with_probabilities(args.input_fasta_path)
-    logo_input_fname = os.path.join(args.outdir, "naive_logo.fasta")
-    cdr3_logo_input_fname = os.path.join(args.outdir, "naive_logo_cdr3.fasta")
-
-    write_logo_input(
+    logo_naives, cdr3_logo_naives = logo_inputs(
         alternative_naives,
-        logo_input_fname,
-        cdr3_logo_input_fname,
         args.aa_cdr3_start,
         args.aa_cdr3_end,
         args.aa_naive_len,
@@ -145,7 +135,7 @@ if __name__ == "__main__":
     options.stacks_per_line = 500
     options.tic_length = 10
 
-    create_logo(logo_input_fname, os.path.join(args.outdir, args.logo_fname), options)
+    create_logo(logo_naives, os.path.join(args.outdir, args.logo_fname), options)
     create_logo(
-        cdr3_logo_input_fname, os.path.join(args.outdir, args.cdr3_logo_fname), options
+        cdr3_logo_naives, os.path.join(args.outdir, args.cdr3_logo_fname), options
     )
@@ -25,30 +25,40 @@ def get_args():
     return parser.parse_args()
 
 
-def main():
-    args = get_args()
-    if len(args.inseqs) < 2:
+def phylip_rename(seqrecords, inferred_naive_name="inferred_naive"):
+    """Change each sequence id to something short and unique (in place), returning a list of mapping dicts recording
+    the changes"""
+    if len(seqrecords) < 2:
         raise Exception(
             "too few sequences (%d) passed to make_phylip.py (need at least two): %s"
-            % (len(args.inseqs), [sr.id for sr in args.inseqs])
+            % (len(seqrecords), [sr.id for sr in seqrecords])
         )
     mapping = []
     i = 0
-    # Go through and change each sequence id to something short and unique, keeping a mapping of the changes
-    for seqrecord in args.inseqs:
+    for seqrecord in seqrecords:
         # Here we hardcod `naive` as the translation for the inferred_naive_name, and this is now assumed in `bin/mkconfig.py`
-        new_id = (
-            "naive" if seqrecord.id == args.inferred_naive_name else "seq-{}".format(i)
-        )
+        new_id = "naive" if seqrecord.id == inferred_naive_name else "seq-{}".format(i)
         mapping.append({"original_id": seqrecord.id, "new_id": new_id})
         seqrecord.id, seqrecord.name = new_id, new_id
         i += 1
-    # write output as phylip and a csv
-    SeqIO.write(args.inseqs, args.outseqs, "phylip")
-    args.outseqs.close()
-    writer = csv.DictWriter(args.seqname_mapping, fieldnames=["original_id", "new_id"])
+    return mapping
+
+
+def write_phylip(seqrecords, outseqs, seqname_mapping, inferred_naive_name):
+    "Write seqrecords as phylip (renaming them) to outseqs, and the renaming as a csv to seqname_mapping"
+    mapping = phylip_rename(seqrecords, inferred_naive_name)
+    SeqIO.write(seqrecords, outseqs, "phylip")
+    writer = csv.DictWriter(seqname_mapping, fieldnames=["original_id", "new_id"])
     writer.writeheader()
     writer.writerows(mapping)
+
+
+def main():
+    args = get_args()
+    write_phylip(
+        args.inseqs, args.outseqs, args.seqname_mapping, args.inferred_naive_name
+    )
+    args.outseqs.close()
     args.seqname_mapping.close()
 
 
@@ -1,76 +1,90 @@
 #!/usr/bin/env python
 
 import argparse
-import collections
-from os import path
 import csv
 import json
-import re
-import pprint
 import yaml
 
+# the C loader is many times faster on large selection metric files, but needs pyyaml built against libyaml
+yaml_loader = getattr(yaml, "CLoader", yaml.Loader)
+
 
 def seqmeta_reader(filename):
+    "Returns the csv fieldnames and a list of rows, in file order"
     with open(filename) as fh:
         reader = csv.DictReader(fh)
-        return {row["sequence"]: row for row in reader}
+        return reader.fieldnames or [], list(reader)
 
 
-def yaml_reader(filename):
+def sel_metric_reader(filename):
     with open(filename) as fh:
-        try:
-            result = yaml.load(fh)
-        except yaml.YAMLError, e:
-            raise
+        if filename.endswith(".json"):
+            result = json.load(fh)
+        else:
+            try:
+                result = yaml.load(fh, Loader=yaml_loader)
+            except yaml.YAMLError, e:
+                raise
         return result if result else {}
 
 
-def merge(d1, d2):
-    d = d1.copy()
-    d.update(d2)
-    return d
-
-
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("tip_seqmeta", type=seqmeta_reader)
-    parser.add_argument("sel_metric_info", type=yaml_reader)
+    parser.add_argument(
+        "sel_metric_info",
+        type=sel_metric_reader,
+        help="selection metrics as written by partis or selection_metrics.py (yaml, or json if named *.json)",
+    )
     parser.add_argument("seqmeta_out", type=argparse.FileType("w"))
     parser.add_argument("metrics", nargs="?", default=["lbi", "lbr", "cons-dist-aa"])
     args = parser.parse_args()
     return args
 
 
+def merged_rows(tip_rows, metric_columns):
+    """Left/outer join of the tip rows with each of the metric columns ({seqid: value} dicts) on sequence id. Tips come
+    first in their input order, followed by sequences only found in the metrics (internal nodes) sorted by id."""
+    tip_ids = set()
+    for row in tip_rows:
+        seqid = row["sequence"]
+        tip_ids.add(seqid)
+        for metric, column in metric_columns:
+            if seqid in column:
+                row[metric] = column[seqid]
+        yield row
+    internal_ids = set()
+    for _, column in metric_columns:
+        internal_ids.update(seqid for seqid in column if seqid not in tip_ids)
+    for seqid in sorted(internal_ids):
+        row = {"sequence": seqid, "unique_id": seqid}
+        for metric, column in metric_columns:
+            if seqid in column:
+                row[metric] = column[seqid]
+        yield row
+
+
 def main():
     args = get_args()
     if len(args.sel_metric_info) == 0:
         print "merge_selection_metrics.py: no clusters in input file"
     elif len(args.sel_metric_info) > 1:
         print "merge_selection_metrics.py warning: info for multiple clusters in input file, arbitrarily taking the first one"
-    sinfo = args.sel_metric_info[0].get("lb", {})
+    sinfo = args.sel_metric_info[0].get("lb", {}) if args.sel_metric_info else {}
     if len(set(args.metrics) - set(sinfo)) > 0:
         print "merge_selection_metrics.py: requested metrics %s not found in input file" % " ".join(
             set(args.metrics) - set(sinfo)
         )
         args.metrics = [m for m in args.metrics if m in sinfo]
 
-    out_fields = args.tip_seqmeta.values()[0].keys() + args.metrics
+    tip_fieldnames, tip_rows = args.tip_seqmeta
     writer = csv.DictWriter(
-        args.seqmeta_out, fieldnames=out_fields, extrasaction="ignore"
+        args.seqmeta_out,
+        fieldnames=tip_fieldnames + [m for m in args.metrics if m not in tip_fieldnames],
+        extrasaction="ignore",
     )
     writer.writeheader()
-
-    seqmeta = collections.defaultdict(lambda: {"tip": False, "internal": True})
-    seqmeta.update(
-        {
-            k: merge(v, {"tip": True, "internal": False})
-            for k, v in args.tip_seqmeta.items()
-        }
-    )
-    for metric in args.metrics:
-        for seqid, val in sinfo[metric].items():
-            seqmeta[seqid].update({"sequence": seqid, "unique_id": seqid, metric: val})
-    for _, row in seqmeta.items():
+    for row in merged_rows(tip_rows, [(m, sinfo[m]) for m in args.metrics]):
         writer.writerow(row)
 
 
@@ -1,32 +1,59 @@
 #!/usr/bin/env python
 
+"""
+Map each tip of a tree to its nearest min-adcl centroid (by path length in the tree).
+"""
+
 import argparse
 import csv
-import dendropy as dendro
+
+import numpy
+
+import array_tree
 
 
 def get_args():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "tree",
-        type=lambda x: dendro.Tree.get(
-            path=x, schema="newick", preserve_underscores=True
-        ),
-    )
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tree", help="newick tree (ignored with --identity)")
     parser.add_argument("centroid_ids", type=argparse.FileType("r"))
     parser.add_argument("cluster_mapping", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--identity",
+        action="store_true",
+        help="map each centroid to itself, for clusters where pruning kept every sequence",
+    )
     return parser.parse_args()
 
 
-def dendro_mapping(tree, centroid_ids):
-    dist_matrix = tree.phylogenetic_distance_matrix()
-    terminals = [n.taxon for n in tree.leaf_node_iter()]
-    centroids = [tree.find_node_with_taxon_label(cid).taxon for cid in centroid_ids]
-    for node in terminals:
-        distance, centroid = min(
-            (dist_matrix.distance(node, centr), centr) for centr in centroids
-        )
-        yield (node.label, centroid.label, distance)
+def nearest_centroid_mapping(tree, centroid_ids):
+    """(tip, nearest centroid, distance) for each tip of the ArrayTree, ties going to the first centroid by name.
+
+    Rather than computing the full distance matrix, the nearest centroid to every node is found in two passes: one up
+    the tree, finding the nearest centroid within each node's subtree, and one back down, also considering the nearest
+    centroid through each node's parent."""
+    lengths = numpy.nan_to_num(tree.length)
+    leaves = numpy.flatnonzero(tree.is_leaf)
+    leaf_index = {tree.names[i]: i for i in leaves}
+    # (distance, centroid name) of the nearest centroid found so far for each node
+    nearest = [(float("inf"), None)] * len(tree)
+    for cid in centroid_ids:
+        nearest[leaf_index[cid]] = (0.0, cid)
+    # nodes are in preorder, so reversed order visits children before their parents
+    for i in range(len(tree) - 1, 0, -1):
+        parent = tree.parent[i]
+        distance, centroid = nearest[i]
+        nearest[parent] = min(nearest[parent], (distance + lengths[i], centroid))
+    for i in range(1, len(tree)):
+        distance, centroid = nearest[tree.parent[i]]
+        nearest[i] = min(nearest[i], (distance + lengths[i], centroid))
+    for i in leaves:
+        distance, centroid = nearest[i]
+        yield (tree.names[i], centroid, distance)
+
+
+def identity_mapping(centroid_ids):
+    for cid in centroid_ids:
+        yield (cid, cid, 0.0)
 
 
 def main():
@@ -34,7 +61,12 @@ def main():
     writer = csv.writer(args.cluster_mapping)
     writer.writerow(["sequence", "centroid", "distance"])
     centroids = [seqid.strip() for seqid in args.centroid_ids.readlines()]
-    for row in dendro_mapping(args.tree, centroids):
+    rows = (
+        identity_mapping(centroids)
+        if args.identity
+        else nearest_centroid_mapping(array_tree.load(args.tree), centroids)
+    )
+    for row in rows:
         writer.writerow(row)
     args.centroid_ids.close()
     args.cluster_mapping.close()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
-from Bio import Phylo
+
+import array_tree
 
 
 def get_args():
@@ -12,12 +13,11 @@ def get_args():
 
 def main():
     args = get_args()
-    tree = Phylo.parse(args.tree, "newick").next()
+    n_terminals = array_tree.load(args.tree).n_leaves
+    # minadcl_clusters.py works on the array tree in linear time and memory (it no longer builds a distance matrix), so
+    # add a small per-tip allowance to a baseline of 1/2 a gig
+    mem_needed = 500 + n_terminals // 10
     # Can't exceed 32000 for memory without having to request a large node
-    n_terminals = len(tree.get_terminals())
-    if n_terminals > 4000:
-        print "--exclusive ",
-    mem_needed = n_terminals * 5
     if mem_needed > 32000:
         print "--partition=largenode ",
     print "--mem={} ".format(mem_needed),
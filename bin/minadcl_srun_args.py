@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 
 import argparse
-from Bio import Phylo
+
+import array_tree
 
 
 def get_args():
@@ -12,9 +13,8 @@ def get_args():
 
 def main():
     args = get_args()
-    tree = Phylo.parse(args.tree, "newick").next()
     # Can't exceed 32000 for memory without having to request a large node
-    n_tips = len(tree.get_terminals())
+    n_tips = array_tree.load(args.tree).n_leaves
     if n_tips > 8000:
         print "--exclusive ",
     # add baseline of 1/2 a gig
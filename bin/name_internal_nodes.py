@@ -1,40 +1,220 @@
 #!/usr/bin/env python
 # this will probably get removed when raxml-ng is implemented unless we need it
+"""
+Gives internal nodes names: by default a prefix and a counter (in level order), with --splits the sorted names of the
+leaves below joined with "-", or with --split-hashes a compact hash of that set of leaves.
+
+The tree is read as an array tree (see array_tree.py) and written out in a single depth-first pass, with each internal
+node named as it is closed. For --splits, each node's sorted leaf names are merged from its children's (which are then
+dropped) rather than collected and sorted afresh, and only the name being written is ever joined into a string. Split
+hashes are the XOR of a 64 bit hash of each leaf name, so take constant time and space per node.
+
+This is a standalone tool, for naming the internal nodes of trees by hand (e.g. to compare splits across trees); the
+build doesn't run it, since raxml-ng and dnaml name the ancestral nodes they reconstruct themselves.
+"""
+
+from __future__ import division
+
 import argparse
-import ete3
+import collections
+import hashlib
+import heapq
+import random
+import re
+import sys
+import time
+
+import array_tree
+
+# characters ete3 replaces with "_" when writing names (as it did when this script wrote trees with ete3)
+_ILLEGAL_NAME_CHARS = re.compile(r"[:;(),\[\]\t\n\r=]")
 
 
 def get_args():
-    parser = argparse.ArgumentParser(
-        description="gives blank internal nodes names; if --splits is specified"
-    )
-    parser.add_argument("intree")
-    parser.add_argument("outtree")
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("intree", nargs="?")
+    parser.add_argument("outtree", nargs="?")
     parser.add_argument("--prefix", default="in-")
-    parser.add_argument("--splits", action="store_true")
-    return parser.parse_args()
+    names = parser.add_mutually_exclusive_group()
+    names.add_argument("--splits", action="store_true")
+    names.add_argument(
+        "--split-hashes",
+        action="store_true",
+        help="name internal nodes with the prefix and a 64 bit hash of their leaf set, rather than the joined leaf names",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="instead of naming a tree, time naming random trees of 1k to 50k tips",
+    )
+    args = parser.parse_args()
+    if not args.benchmark and not (args.intree and args.outtree):
+        parser.error("intree and outtree are required")
+    return args
+
+
+def level_order_ranks(tree, children):
+    "Rank of each internal node in level order (the order ete3's traverse() visits them)"
+    ranks = {}
+    queue = collections.deque([0])
+    while queue:
+        node = queue.popleft()
+        if children[node]:
+            ranks[node] = len(ranks)
+            queue.extend(children[node])
+    return ranks
+
+
+def leaf_hash(name):
+    return int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def format_name(name):
+    return _ILLEGAL_NAME_CHARS.sub("_", name)
 
 
-def splits_name(tree_node):
-    new_name = "-".join(sorted(n.name for n in tree_node.get_leaves()))
-    return new_name
+def format_length(length):
+    # missing branch lengths are written as ete3 writes its default
+    return "%0.6g" % (1.0 if length != length else length)
+
+
+def iter_named_newick(tree, prefix="in-", splits=False, split_hashes=False):
+    """Yields the pieces of the newick for the ArrayTree tree, with internal nodes named (the root's name isn't
+    written, as by ete3)"""
+    children = tree.children()
+    if not (splits or split_hashes):
+        ranks = level_order_ranks(tree, children)
+    # for each node whose subtree has been written but whose parent is still open: its sorted leaf names or leaf hash
+    subtree_leaves = {}
+    # (node, closing) pairs; a node is pushed again, to be closed, once its children have been written
+    stack = [(0, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing:
+            if splits:
+                leaves = list(
+                    heapq.merge(*[subtree_leaves.pop(c) for c in children[node]])
+                )
+                subtree_leaves[node] = leaves
+                name = "-".join(leaves)
+            elif split_hashes:
+                leaves = 0
+                for c in children[node]:
+                    leaves ^= subtree_leaves.pop(c)
+                subtree_leaves[node] = leaves
+                name = "{}{:016x}".format(prefix, leaves)
+            else:
+                name = prefix + str(ranks[node])
+            yield ")"
+            if node != 0:
+                yield format_name(name) + ":" + format_length(tree.length[node])
+            continue
+        parent = tree.parent[node]
+        if node != 0 and node != children[parent][0]:
+            yield ","
+        if children[node]:
+            yield "("
+            stack.append((node, True))
+            stack.extend((c, False) for c in reversed(children[node]))
+        else:
+            name = tree.names[node]
+            if splits:
+                subtree_leaves[node] = [name]
+            elif split_hashes:
+                subtree_leaves[node] = leaf_hash(name)
+            yield format_name(name) + ":" + format_length(tree.length[node])
+    yield ";"
+
+
+def write_named_newick(tree, outfile, **kwargs):
+    "Stream the newick out in pieces of about a megabyte"
+    buf, size = [], 0
+    for piece in iter_named_newick(tree, **kwargs):
+        buf.append(piece)
+        size += len(piece)
+        if size > 1 << 20:
+            outfile.write("".join(buf))
+            buf, size = [], 0
+    outfile.write("".join(buf))
+
+
+def random_tree(n_tips, seed=0):
+    "A random binary ArrayTree with n_tips leaves, built by repeatedly splitting random leaves"
+    rng = random.Random(seed)
+    parent, leaves = [-1], [0]
+    for _ in range(n_tips - 1):
+        split = leaves.pop(rng.randrange(len(leaves)))
+        for _ in range(2):
+            leaves.append(len(parent))
+            parent.append(split)
+    # renumber into preorder, as array trees are
+    children = [[] for _ in parent]
+    for node, p in enumerate(parent[1:], 1):
+        children[p].append(node)
+    order, stack = [], [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(reversed(children[node]))
+    new_index = {node: i for i, node in enumerate(order)}
+    return array_tree.ArrayTree(
+        [new_index[parent[node]] if node else -1 for node in order],
+        [rng.random() * 0.01 if node else float("nan") for node in order],
+        ["seq{}".format(node) if not children[node] else "" for node in order],
+    )
+
+
+def benchmark(sizes=(1000, 5000, 10000, 50000), ete3_max_size=10000):
+    "Time naming random trees of the given sizes, compared with naming splits through ete3 (for smaller trees)"
+    import ete3
+
+    def ete3_splits(tree):
+        for node in tree.traverse():
+            if not node.is_leaf():
+                node.name = "-".join(sorted(n.name for n in node.get_leaves()))
+        return tree.write(format=1)
+
+    class NullFile(object):
+        def write(self, s):
+            pass
+
+    for n_tips in sizes:
+        tree = random_tree(n_tips)
+        timings = [
+            (
+                "splits",
+                lambda: write_named_newick(tree, NullFile(), splits=True),
+            ),
+            (
+                "split-hashes",
+                lambda: write_named_newick(tree, NullFile(), split_hashes=True),
+            ),
+        ]
+        if n_tips <= ete3_max_size:
+            ete3_tree = tree.to_ete3()
+            timings.insert(0, ("ete3 splits", lambda: ete3_splits(ete3_tree)))
+        for label, fn in timings:
+            start = time.time()
+            fn()
+            sys.stdout.write(
+                "{} tips, {}: {:.3f}s\n".format(n_tips, label, time.time() - start)
+            )
 
 
 def main():
     args = get_args()
-    # should have optiion for always rebuilding all internal nodes (rename?)
-    # should be able to do this with the format opton in load below?
-    tree = ete3.Tree(args.intree, format=1)
-    i = 0
-    for node in tree.traverse():
-        # if not node.name:
-        if not node.is_leaf():
-            if args.splits:
-                node.name = splits_name(node)
-            else:
-                node.name = args.prefix + str(i)
-                i += 1
-    tree.write(outfile=args.outtree, format=1)
+    if args.benchmark:
+        benchmark()
+        return
+    tree = array_tree.load(args.intree)
+    with open(args.outtree, "w") as outfile:
+        write_named_newick(
+            tree,
+            outfile,
+            prefix=args.prefix,
+            splits=args.splits,
+            split_hashes=args.split_hashes,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replace ambiguous (or otherwise unwanted) characters in sequences with N.
+
+By default everything other than ACGT is replaced; with --chars only the given characters are. Header lines are
+copied verbatim. FASTA files are memory-mapped and processed in large chunks with a 256-byte translation table, so
+the work per chunk is a single bytes.translate call plus a scan for header lines.
+"""
+
+from __future__ import division
+
+import argparse
+import mmap
+import os
+import re
+import sys
+import time
+
+DEFAULT_CHUNK_SIZE = 1 << 24
+_HEADER_LINE = re.compile(b"^>[^\n]*", re.MULTILINE)
+_tables = {}
+
+
+def translation_table(chars=None, replacement="N"):
+    """A bytes.translate table mapping chars (or, if chars is None, everything other than ACGT) to replacement.
+    Line endings are always left alone."""
+    key = (chars, replacement)
+    if key not in _tables:
+        if chars is None:
+            table = bytearray(ord(replacement) for _ in range(256))
+            for keep in "ACGT\r\n":
+                table[ord(keep)] = ord(keep)
+        else:
+            table = bytearray(range(256))
+            for char in chars:
+                table[ord(char)] = ord(replacement)
+        _tables[key] = bytes(table)
+    return _tables[key]
+
+
+def normalize_seq(seq, chars=None, replacement="N"):
+    "Normalize a single sequence string"
+    return seq.translate(translation_table(chars, replacement))
+
+
+def normalize_chunk(chunk, table):
+    "Translate the sequence lines of a chunk of FASTA (made of whole lines), keeping header lines as they are"
+    pieces = []
+    start = 0
+    for m in _HEADER_LINE.finditer(chunk):
+        pieces.append(chunk[start : m.start()].translate(table))
+        pieces.append(m.group())
+        start = m.end()
+    pieces.append(chunk[start:].translate(table))
+    return b"".join(pieces)
+
+
+def iter_chunks(buf, chunk_size=DEFAULT_CHUNK_SIZE):
+    "Split buf into chunks of about chunk_size bytes, ending on line boundaries"
+    start, size = 0, len(buf)
+    while start < size:
+        end = min(start + chunk_size, size)
+        if end < size:
+            newline = buf.find(b"\n", end)
+            end = size if newline == -1 else newline + 1
+        yield buf[start:end]
+        start = end
+
+
+def normalize_fasta(
+    infname, outfile, chars=None, replacement="N", chunk_size=DEFAULT_CHUNK_SIZE
+):
+    "Write infname to the open (binary) outfile with ambiguous characters of its sequences replaced"
+    table = translation_table(chars, replacement)
+    with open(infname, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for chunk in iter_chunks(buf, chunk_size):
+                outfile.write(normalize_chunk(chunk, table))
+        finally:
+            buf.close()
+
+
+def benchmark(infname, chars=None, replacement="N", repeats=3):
+    """Compare the throughput of normalize_fasta with per-record regex substitution (the approach this replaced) on
+    infname, printing MB/s for each"""
+    size_mb = os.path.getsize(infname) / 1e6
+    pattern = re.compile(
+        "[^ACGT]" if chars is None else "[{}]".format(re.escape(chars))
+    )
+
+    def regex_normalize(outfile):
+        with open(infname) as fh:
+            for line in fh:
+                outfile.write(
+                    line
+                    if line.startswith(">")
+                    else pattern.sub(replacement, line.rstrip("\n")) + "\n"
+                )
+
+    def chunked_normalize(outfile):
+        normalize_fasta(infname, outfile, chars, replacement)
+
+    for name, fn in [("regex", regex_normalize), ("chunked", chunked_normalize)]:
+        timings = []
+        for _ in range(repeats):
+            with open(os.devnull, "wb") as devnull:
+                start = time.time()
+                fn(devnull)
+                timings.append(time.time() - start)
+        best = min(timings)
+        sys.stdout.write(
+            "{}: {:.1f} MB in {:.3f}s ({:.1f} MB/s)\n".format(
+                name, size_mb, best, size_mb / best if best else float("inf")
+            )
+        )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("infile", help="FASTA file")
+    parser.add_argument(
+        "outfile", nargs="?", default="-", help="output FASTA file (default stdout)"
+    )
+    parser.add_argument(
+        "--chars",
+        help="characters to replace (default: everything other than ACGT and line endings)",
+    )
+    parser.add_argument("--replacement", default="N")
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="instead of writing output, report the throughput of normalizing infile",
+    )
+    args = parser.parse_args()
+    if len(args.replacement) != 1:
+        parser.error("--replacement must be a single character")
+    return args
+
+
+def main():
+    args = get_args()
+    if args.benchmark:
+        benchmark(args.infile, args.chars, args.replacement)
+        return
+    outfile = (
+        getattr(sys.stdout, "buffer", sys.stdout)
+        if args.outfile == "-"
+        else open(args.outfile, "wb")
+    )
+    try:
+        normalize_fasta(args.infile, outfile, args.chars, args.replacement)
+    finally:
+        if args.outfile != "-":
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
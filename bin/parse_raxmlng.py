@@ -6,7 +6,6 @@ Parse the output ancestral state reconstruction from RAxML-NG together with the
 to create an ete3 tree with the ancestral sequences.
 """
 
-import re
 from warnings import warn
 from Bio.SeqRecord import SeqRecord
 from Bio import SeqIO
@@ -14,6 +13,8 @@ from Bio.Seq import Seq
 from ete3 import Tree
 import argparse
 
+import normalize_ambiguities
+
 
 class TreeFileParsingError(Exception):
     """When ete3 fails to read the input tree."""
@@ -61,15 +62,10 @@ def write_ancestors_naive_and_seed(
     )
 
 
-def replace_ambiguous_nucleotides(seq):
-    """Replaces anything other than ACGT with N"""
-    return re.sub(r"[^ACGT]", "N", seq)
-
-
 def parse_raxmlng_ancestral_state(line):
     asr_seqid, asr_seq = line.strip().split()
     return SeqRecord(
-        Seq(replace_ambiguous_nucleotides(asr_seq)),
+        Seq(normalize_ambiguities.normalize_seq(asr_seq)),
         id=asr_seqid,
         name="",
         description="",
@@ -18,6 +18,8 @@ from Bio import SeqIO
 from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 
+import normalize_ambiguities
+
 # iterate over recognized sections in the phylip output file.
 def sections(fh):
     patterns = {
@@ -56,11 +58,6 @@ def iter_edges(fh):
             break
 
 
-def replace_ambiguous_nucleotides(seq):
-    """Replaces anything other than ACGT with N"""
-    return re.sub(r"[^ACGT]", "N", seq)
-
-
 # iterate over entries in the sequences section
 def parse_seqdict(fh, mode="dnaml"):
     # EH: this I'm guessing is what the lines being parsed by the regular expression will look like?
@@ -76,7 +73,7 @@ def parse_seqdict(fh, mode="dnaml"):
     for line in fh:
         m = patterns[mode].match(line)
         if m:
-            seqs[m.group("id")] += replace_ambiguous_nucleotides(
+            seqs[m.group("id")] += normalize_ambiguities.normalize_seq(
                 m.group("seq").replace(" ", "")
             )
         elif line.rstrip() == "":
@@ -5,11 +5,13 @@ import argparse
 import os
 import os.path
 import csv
+import hashlib
 import json
 import sys
 import textwrap
 import time
 import collections
+import heapq
 import numpy
 import warnings
 
@@ -29,6 +31,9 @@ if not partis_path or not os.path.exists(partis_path):
     print (textwrap.dedent(msg))
     sys.exit(1)
 
+import alignment_io
+import translation
+
 sys.path.insert(1, os.path.join(partis_path, "python"))
 import utils
 import indelutils
@@ -82,20 +87,41 @@ def as_dict_rows(column_dict, columns=None):
     return [{c: column_dict[c][i] for c in columns} for i in range(max(column_lengths))]
 
 
-def apply_filters(args, cluster_line):
-    def filter_fn(iseq):
-        if args.remove_frameshifts and not cluster_line["in_frames"][iseq]:
-            return False
-        elif args.remove_stops and cluster_line["stops"][iseq]:
-            return False
-        elif (
-            args.remove_mutated_invariants and cluster_line["mutated_invariants"][iseq]
-        ):
-            return False
-        else:
-            return True
+def annotation_summary(cluster_line):
+    """Boolean masks over the sequences of a cluster annotation of those which are frameshifted, contain stops, have
+    mutated invariants, have indels, and are functional (as by partis' utils.is_functional: none of the first three),
+    under "masks", and the number of each under "counts". Computed once per annotation, for the SConstruct's cluster
+    checks and the filters here."""
+    masks = {
+        "frameshifted": ~numpy.array(cluster_line["in_frames"], dtype=bool),
+        "stops": numpy.array(cluster_line["stops"], dtype=bool),
+        "mutated_invariants": numpy.array(
+            cluster_line["mutated_invariants"], dtype=bool
+        ),
+        "indels": numpy.array(
+            [indelutils.has_indels(indelfo) for indelfo in cluster_line["indelfos"]],
+            dtype=bool,
+        ),
+    }
+    masks["functional"] = ~(
+        masks["frameshifted"] | masks["stops"] | masks["mutated_invariants"]
+    )
+    return {
+        "masks": masks,
+        "counts": {key: int(mask.sum()) for key, mask in masks.items()},
+    }
 
-    return filter(filter_fn, range(len(cluster_line["input_seqs"])))
+
+def apply_filters(args, summary):
+    masks = summary["masks"]
+    keep = numpy.ones(len(masks["functional"]), dtype=bool)
+    if args.remove_frameshifts:
+        keep &= ~masks["frameshifted"]
+    if args.remove_stops:
+        keep &= ~masks["stops"]
+    if args.remove_mutated_invariants:
+        keep &= ~masks["mutated_invariants"]
+    return [int(iseq) for iseq in numpy.flatnonzero(keep)]
 
 
 def add_regional_bounds(cluster_line):
@@ -146,13 +172,7 @@ def get_cluster_seqs_dict(cluster_line, seed_id, args):
     return as_dict_rows(cluster_sequences)
 
 
-def get_cluster_meta_dict(cluster_line, seed_id, args):
-    has_indels = any(
-        [
-            indelutils.has_indels(cluster_line["indelfos"][iseq])
-            for iseq in range(len(cluster_line["input_seqs"]))
-        ]
-    )
+def get_cluster_meta_dict(cluster_line, seed_id, args, has_indels):
     if not args.indel_reversed_seqs and not has_indels:
         warnings.warn(
             "{}: --indel-reversed-seqs was not passed and there are no indels. If running this script from CFT, this is probably because CFT was run with --preserve-indels and there are no indels in this cluster. It will get aligned anyway.".format(
@@ -171,12 +191,23 @@ def get_cluster_meta_dict(cluster_line, seed_id, args):
     }
 
 
-def add_additional_info(cluster_line, additional_per_seq_info, iseqs_to_keep):
-    for key in additional_per_seq_info:
-        cluster_line[key] = [
-            additional_per_seq_info[key][iseq] for iseq in iseqs_to_keep
-        ]
-    return cluster_line
+def restrict_annotation(cluster_line, iseqs_to_keep, glfo):
+    """Restrict cluster_line to the sequences iseqs_to_keep (in that order). utils.restrict_to_iseqs removes partis'
+    implicit info and derives it again for the kept sequences; here the derived per sequence keys are subset along with
+    the rest instead, since the per cluster implicit info doesn't depend on which sequences are kept. Falls back to
+    utils.restrict_to_iseqs for a line with any per sequence lists not in utils.linekeys["per_seq"]."""
+    n_seqs = len(cluster_line["unique_ids"])
+    per_seq_keys = set(utils.linekeys["per_seq"]) & set(cluster_line)
+    unknown_per_seq_keys = [
+        key
+        for key, value in cluster_line.items()
+        if key not in per_seq_keys and isinstance(value, list) and len(value) == n_seqs
+    ]
+    if not iseqs_to_keep or unknown_per_seq_keys:
+        utils.restrict_to_iseqs(cluster_line, iseqs_to_keep, glfo)
+        return
+    for key in per_seq_keys:
+        cluster_line[key] = [cluster_line[key][iseq] for iseq in iseqs_to_keep]
 
 
 def downsample_iseqs_by_multiplicity(
@@ -241,6 +272,19 @@ def timepoint_multiplicity_mapping(duplicates, upstream_seqmeta):
     return timepoints_dict
 
 
+def sequence_multiplicities(cluster_line, upstream_seqmeta):
+    "Multiplicity of each sequence, as in get_multiplicity_seqmeta but without the per timepoint breakdown"
+    return [
+        sum(
+            int(get_upstream_row(upstream_seqmeta, dup_seqid)["multiplicity"])
+            for dup_seqid in [seqid] + duplicates
+        )
+        for seqid, duplicates in zip(
+            cluster_line["unique_ids"], cluster_line["duplicates"]
+        )
+    ]
+
+
 def get_multiplicity_seqmeta(cluster_line, upstream_seqmeta):
     """"Merge upstream (pre-partis) metadata, indexed in a dict by unique_id, (potentially)
     including timepoint and multiplicity info, with the metadata output of process_partis (partis_seqmeta)."""
@@ -296,9 +340,9 @@ def match_indels_in_uid_seq(cluster_line, match_indels_in_uid):
     return iseqs_to_keep
 
 
-def check_seed_for_indels(cluster_line, seed_id, partition_file):
+def check_seed_for_indels(cluster_line, summary, seed_id, partition_file):
     iseq_seed = cluster_line["unique_ids"].index(seed_id)
-    if indelutils.has_indels(cluster_line["indelfos"][iseq_seed]):
+    if summary["masks"]["indels"][iseq_seed]:
         print (indelutils.get_dbg_str(cluster_line["indelfos"][iseq_seed]))
         raise Exception(
             "indel in seed sequence {}. Options are 1. Look at the annotation for this cluster and find the indel in the seed. Rerun process_partis.py with --match-indels-in-uid <uid-of-seq-containing-indel-of-interest> to process only sequences containing that specific indel for further analysis of the indel 2. Run with --ignore-seed-indels. PS check out {}".format(
@@ -308,14 +352,19 @@ def check_seed_for_indels(cluster_line, seed_id, partition_file):
 
 
 def process_cluster(args, cluster_line, seed_id, glfo):
+    # Implicit info is derived for the whole cluster, before choosing the sequences to keep: the frameshift, stop and
+    # mutated invariant filters and unique_seqs_count need functional info for every sequence, and partis derives all
+    # the implicit keys of a line together, with no way of asking for only those the writers below use.
+    # restrict_annotation then subsets the derived keys, rather than deriving them again for the kept sequences.
     utils.add_implicit_info(glfo, cluster_line)
+    summary = annotation_summary(cluster_line)
 
     if (
         seed_id is not None
         and not args.match_indels_in_uid
         and not args.ignore_seed_indels
     ):
-        check_seed_for_indels(cluster_line, seed_id, args.partition_file)
+        check_seed_for_indels(cluster_line, summary, seed_id, args.partition_file)
     # assume we want all seqs in cluster
     iseqs_to_keep = set(range(len(cluster_line["input_seqs"])))
     # various cases where we downsample cluster sequences
@@ -336,9 +385,7 @@ def process_cluster(args, cluster_line, seed_id, glfo):
             }.values()
         )
     if args.remove_frameshifts or args.remove_stops or args.remove_mutated_invariants:
-        iseqs_to_keep = iseqs_to_keep & set(apply_filters(args, cluster_line))
-    # apply merging of multiplicity info here (or flesh out with default values otherwise)
-    multiplicity_seqmeta = get_multiplicity_seqmeta(cluster_line, args.upstream_seqmeta)
+        iseqs_to_keep = iseqs_to_keep & set(apply_filters(args, summary))
 
     # apply sequence downsampling here
     cluster_line["unique_seqs_count"] = len(
@@ -348,23 +395,31 @@ def process_cluster(args, cluster_line, seed_id, glfo):
     if args.max_sequences:
         iseqs_to_keep = iseqs_to_keep & set(
             downsample_iseqs_by_multiplicity(
-                cluster_line, multiplicity_seqmeta, args.max_sequences, always_include
+                cluster_line,
+                {
+                    "multiplicities": sequence_multiplicities(
+                        cluster_line, args.upstream_seqmeta
+                    )
+                },
+                args.max_sequences,
+                always_include,
             )
         )
     cluster_line["sampled_seqs_count"] = len(iseqs_to_keep)
+    # keep sequences in annotation order
+    iseqs_to_keep = sorted(iseqs_to_keep)
+    has_indels = bool(summary["masks"]["indels"][iseqs_to_keep].any())
 
     # filter cluster line to iseqs_to_keep
-    utils.restrict_to_iseqs(cluster_line, iseqs_to_keep, glfo)
+    restrict_annotation(cluster_line, iseqs_to_keep, glfo)
 
-    # add the additional info computed in above for the iseqs we care about
-    cluster_line = add_additional_info(
-        cluster_line, multiplicity_seqmeta, iseqs_to_keep
-    )
+    # apply merging of multiplicity info here (or flesh out with default values otherwise), for the iseqs we care about
+    cluster_line.update(get_multiplicity_seqmeta(cluster_line, args.upstream_seqmeta))
 
     cluster_line["total_read_count"] = sum(
         cluster_line["multiplicities"]
     )  # total reads accounting for multiplicity (must be calculated after subsetting cluster in restrict_to_iseqs if it should correspond to total reads represented by subset of cluster returned by restrict_to_iseqs)
-    # this needs to happen after restrict_to_iseqs re-adds implicit partis linekeys including 'regional_bounds'
+    # this needs partis' implicit linekeys, including 'regional_bounds'
     cluster_line, regional_bounds_keys = add_regional_bounds(cluster_line)
     return merge(
         subset_dict(
@@ -384,7 +439,20 @@ def process_cluster(args, cluster_line, seed_id, glfo):
                 "j_per_gene_support",
             ],
         ),
-        get_cluster_meta_dict(cluster_line, seed_id, args),
+        get_cluster_meta_dict(cluster_line, seed_id, args, has_indels),
+    )
+
+
+def largest_cluster_indices(clusters, k=None):
+    """Indices of the k largest of clusters (all of them if k is None), largest first, with clusters of the same size in
+    partition order. This is the order of `sorted(clusters, key=len, reverse=True)`, which defines the `--cluster`
+    indices here and the cluster indices in the SConstruct, but only the k clusters asked for are ever sorted."""
+    if k is None or k >= len(clusters):
+        sizes = numpy.fromiter((len(c) for c in clusters), dtype=numpy.int64)
+        # a stable sort on decreasing size keeps ties in partition order
+        return [int(i) for i in numpy.argsort(-sizes, kind="mergesort")]
+    return heapq.nsmallest(
+        k, range(len(clusters)), key=lambda i: (-len(clusters[i]), i)
     )
 
 
@@ -396,17 +464,17 @@ def find_largest_cluster_across_partitions(cpath, annotation_list):
     seed = cpath.seed_unique_id
     largest_cluster_len = 0
     for i, partition in enumerate(cpath.partitions):
-        clusters_by_size = sorted(
-            partition, key=lambda cluster: len(set(cluster)), reverse=True
-        )
         if seed is not None:
-            clusters_by_size = list(filter(lambda c: seed in c, clusters_by_size))
-            if len(clusters_by_size) == 0:
+            partition = [cluster for cluster in partition if seed in cluster]
+            if len(partition) == 0:
                 raise Exception(
                     " --largest-cluster-across-partitions specified for a seeded partition and no clusters contain the seed. This should not happen, as both the seed info and the cluster ids are coming from partis here. Make sure the partition file specified is a valid partition that includes the seed sequence."
                 )
-        uids_largest_cluster_in_partition = clusters_by_size[0]
-        unique_id_count = len(set(uids_largest_cluster_in_partition))
+        # max keeps the first of equally large clusters, as sorting by size would
+        unique_id_count, uids_largest_cluster_in_partition = max(
+            ((len(set(cluster)), cluster) for cluster in partition),
+            key=lambda x: x[0],
+        )
         if unique_id_count > largest_cluster_len:
             uids_largest_cluster = uids_largest_cluster_in_partition
             largest_cluster_len = unique_id_count
@@ -436,8 +504,11 @@ def choose_cluster(
         )
     # otherwise, assume we have args.cluster or default it to 0
     else:
-        clusters = sorted(cpath.partitions[ipart], key=len, reverse=True)
-        cluster_unique_ids = clusters[i_cluster or 0]
+        clusters = cpath.partitions[ipart]
+        i_cluster = i_cluster or 0
+        cluster_unique_ids = clusters[
+            largest_cluster_indices(clusters, i_cluster + 1)[i_cluster]
+        ]
 
     # Get cluster annotation and put together into
     annotations = [l for l in annotation_list if l["unique_ids"] == cluster_unique_ids]
@@ -454,14 +525,19 @@ def choose_cluster(
     return annotations[0]
 
 
-def read_partis_output(partition_file, glfo_dir=None, locus=None):
+def read_partis_output(
+    partition_file, glfo_dir=None, locus=None, add_implicit_info=True
+):
+    """Without add_implicit_info, the annotations are as in the file, without the info partis derives from them
+    (alignments to the naive, functional info etc.), which then has to be added (by utils.add_implicit_info) to any
+    annotation that's used."""
     glfo = (
         None
         if utils.getsuffix(partition_file) == ".yaml"
         else glutils.read_glfo(glfo_dir if glfo_dir else default_glfo_dir, locus)
     )
     glfo, annotation_list, cpath = utils.read_output(
-        partition_file, glfo=glfo
+        partition_file, glfo=glfo, dont_add_implicit_info=not add_implicit_info
     )  # returns glfo from the file if it's there, otherwise it returns the one we passed in
     return glfo, annotation_list, cpath
 
@@ -470,8 +546,9 @@ def processed_data(args):
     """Uses args to find the correct partition, cluster pair and all associated information. Cluster
     information is returned as by process_cluster."""
 
+    # implicit info is only added to the chosen cluster (in process_cluster), not every annotation in the file
     glfo, annotation_list, cpath = read_partis_output(
-        args.partition_file, args.glfo_dir, args.locus
+        args.partition_file, args.glfo_dir, args.locus, add_implicit_info=False
     )
     if annotation_list is None:
         raise Exception(
@@ -506,16 +583,28 @@ def processed_data(args):
     }
     if args.seqs_out:
         data["seqs_file"] = os.path.relpath(args.seqs_out, args.paths_relative_to)
+    if args.naive_probabilities_out:
+        data["naive_probabilities"] = ranked_naive_probabilities(cluster_annotation)
     # Process the annotation file specific details/data
     data.update(process_cluster(args, cluster_annotation, cpath.seed_unique_id, glfo))
     return data
 
 
+def ranked_naive_probabilities(cluster_annotation):
+    "Partis' alternative naive sequences for the cluster, as (seq, probability) pairs from most to least probable"
+    alternatives = cluster_annotation.get("alternative-annotations") or {}
+    return sorted(
+        alternatives.get("naive-seqs") or [], key=lambda x: x[1], reverse=True
+    )
+
+
 def write_cluster_meta(args, cluster_data):
     def attrs(base):
         return [base + "_" + k for k in ["gene", "start", "end", "per_gene_support"]]
 
-    dont_keep = set(["n_clusters", "seed_id", "sequences", "logprob"])
+    dont_keep = set(
+        ["n_clusters", "seed_id", "sequences", "logprob", "naive_probabilities"]
+    )
     doc = subset_dict(cluster_data, set(cluster_data) - dont_keep)
     for gene in "vdj":
         attr = gene + "_per_gene_support"
@@ -578,6 +667,60 @@ def write_seqs(args, cluster_data):
         )
 
 
+def write_alignment(args, cluster_data):
+    alignment_io.write_alignment(
+        alignment_io.from_seqs(
+            (sequence["unique_id"], sequence.get("seq", ""))
+            for sequence in cluster_data["sequences"]
+        ),
+        args.alignment_out,
+    )
+
+
+def write_naive_probabilities(args, cluster_data):
+    """Write the alternative naives, ranked by probability, to a fasta and their translations to another, named as
+    `naive_<rank>_probability_<probability>`"""
+    naives = cluster_data["naive_probabilities"]
+    aa_seqs = translation.translate_batch(naive_seq for naive_seq, _ in naives)
+    with open(args.naive_probabilities_out[0], "w") as ranked_fasta, open(
+        args.naive_probabilities_out[1], "w"
+    ) as aa_ranked_fasta:
+        for rank, ((naive_seq, probability), aa_seq) in enumerate(zip(naives, aa_seqs)):
+            name = "naive_{}_probability_{}".format(rank, probability)
+            ranked_fasta.write(">%s\n%s\n" % (name, naive_seq))
+            aa_ranked_fasta.write(">%s\n%s\n" % (name, aa_seq))
+
+
+def cluster_signature(cluster_data):
+    """Hash of the cluster's sorted (unique_id, seq, multiplicity) set and reading frame, which only changes when
+    the content of the cluster does (unlike the partition file it came from)."""
+    digest = hashlib.sha1()
+    for row in sorted(
+        (
+            sequence["unique_id"],
+            sequence.get("seq", ""),
+            str(sequence.get("multiplicity")),
+        )
+        for sequence in cluster_data["sequences"]
+    ):
+        digest.update("\t".join(row) + "\n")
+    digest.update("cdr3_start\t{}\n".format(cluster_data["cdr3_start"]))
+    return digest.hexdigest()
+
+
+def write_signature(args, cluster_data):
+    """Write the cluster signature along with the reading frame, so that per-cluster build steps needing only those
+    can depend on this file rather than on the cluster metadata (which changes whenever the partition file does)"""
+    doc = {
+        "signature": cluster_signature(cluster_data),
+        "cdr3_start": cluster_data["cdr3_start"],
+    }
+    if args.namespace:
+        doc = {args.namespace + ":" + k: v for k, v in doc.items()}
+    with open(args.signature_out, "w") as outfile:
+        json.dump(doc, outfile, sort_keys=True, indent=4)
+
+
 def parse_args():
     def existing_file(fname):
         """Argparse type for an existing file"""
@@ -604,6 +747,20 @@ def parse_args():
     outputs.add_argument("--seqmeta-out", help="per sequence metadata CSV file")
     outputs.add_argument("--seqs-out", help="cluster sequences as a FASTA file")
     outputs.add_argument("--cluster-meta-out", help="cluster sequences as a JSON file")
+    outputs.add_argument(
+        "--signature-out",
+        help="JSON file with a content hash of the cluster sequences, and the reading frame",
+    )
+    outputs.add_argument(
+        "--alignment-out",
+        help="cluster sequences as a memory-mappable alignment container (see alignment_io.py)",
+    )
+    outputs.add_argument(
+        "--naive-probabilities-out",
+        nargs=2,
+        metavar=("NT_FASTA", "AA_FASTA"),
+        help="partis alternative naive sequences, and their translations, as fastas in order of probability",
+    )
 
     partis_args = parser.add_argument_group(
         title="Partis args",
@@ -741,6 +898,12 @@ def main():
         write_cluster_meta(args, cluster_data)
     if args.seqs_out:
         write_seqs(args, cluster_data)
+    if args.alignment_out:
+        write_alignment(args, cluster_data)
+    if args.signature_out:
+        write_signature(args, cluster_data)
+    if args.naive_probabilities_out:
+        write_naive_probabilities(args, cluster_data)
 
 
 if __name__ == "__main__":
@@ -5,9 +5,10 @@ Return a reduced set of taxa based on either seed lineage selection ("pruning")
 or min ADCL selection ("trimming").
 """
 
-from ete3 import Tree
 from process_asr import find_node, reroot_tree
 
+import array_tree
+
 import subprocess
 import argparse
 import sys
@@ -40,7 +41,7 @@ def seed_lineage_selection(args):
     closest taxon to the root to seed lineage, until we have gotten the required
     number of taxa.
     """
-    tree = args.tree
+    tree = args.tree.to_ete3()
 
     # Set args.n_keep to the min of requested value and the actual number of seqs (make sure to do this before rerooting, or len(tree) will have decremented...)
     n_keep = min(args.n_keep, len(tree))
@@ -106,7 +107,7 @@ def min_adcl_selection(args):
     """
     Minimize ADCL for a tree using pplacer suite.
     """
-    tipnames = [t.name for t in args.tree.iter_leaves()]
+    tipnames = args.tree.leaf_names()
     if len(tipnames) <= args.n_keep:
         return tipnames
     else:
@@ -142,10 +143,6 @@ def min_adcl_selection(args):
         return keep_names
 
 
-def tree_arg(tree_arg_value):
-    return Tree(tree_arg_value, format=1)
-
-
 def get_args():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument("tree_file", help="input newick tree file")
@@ -171,8 +168,10 @@ def get_args():
         default=100,
     )
     args = parser.parse_args()
-    args.tree = tree_arg(args.tree_file)
-    leaf_names = set(args.tree.get_leaf_names())
+    # parsed once into arrays (shared with the other scripts reading this tree), and only built into an ete3 tree for
+    # seed lineage selection
+    args.tree = array_tree.load(args.tree_file)
+    leaf_names = set(args.tree.leaf_names())
     args.always_include = set(
         filter(
             lambda leaf_name: leaf_name and leaf_name in leaf_names,
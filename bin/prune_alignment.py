@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Subset an alignment to the pruned sequence ids, and remove the columns which are then entirely gaps (from insertions
+in sequences which were pruned out). The alignment is loaded once as a 2D byte array (see alignment_io.py), so both
+steps are simple array operations. Optionally also writes the pruned alignment as phylip (see make_phylip.py).
+"""
+
+import argparse
+
+import alignment_io
+import make_phylip
+
+GAP = ord("-")
+
+
+def prune_alignment(alignment, keep_ids):
+    """Restrict the alignment to rows whose ids are in keep_ids (keeping alignment order), and drop all-gap columns.
+    Returns the pruned (in-memory) Alignment."""
+    if not alignment.is_aligned:
+        raise ValueError("sequences to prune are not all the same length")
+    keep_ids = set(keep_ids)
+    pruned = alignment.subset(
+        [i for i, seqid in enumerate(alignment.ids) if seqid in keep_ids]
+    )
+    pruned.matrix = pruned.matrix[:, (pruned.matrix != GAP).any(axis=0)]
+    pruned.lengths = [pruned.matrix.shape[1]] * len(pruned)
+    return pruned
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "pruned_ids",
+        type=argparse.FileType("r"),
+        help="file with the ids of the sequences to keep, one per line",
+    )
+    parser.add_argument("alignment", help="aligned fasta, or alignment container")
+    parser.add_argument("outseqs", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--phylip-out",
+        type=argparse.FileType("w"),
+        help="also write the pruned alignment as phylip, with sequences renamed as in make_phylip.py",
+    )
+    parser.add_argument(
+        "--seqname-mapping",
+        type=argparse.FileType("w"),
+        help="csv mapping original to phylip sequence names (required with --phylip-out)",
+    )
+    parser.add_argument("--inferred-naive-name", default="inferred_naive")
+    args = parser.parse_args()
+    if bool(args.phylip_out) != bool(args.seqname_mapping):
+        parser.error("--phylip-out and --seqname-mapping must be used together")
+    return args
+
+
+def main():
+    args = get_args()
+    keep_ids = [line.strip() for line in args.pruned_ids if line.strip()]
+    pruned = prune_alignment(
+        alignment_io.read_alignment(args.alignment), keep_ids=keep_ids
+    )
+    alignment_io.write_fasta(pruned, args.outseqs)
+    args.outseqs.close()
+    if args.phylip_out:
+        make_phylip.write_phylip(
+            list(pruned.seqrecords()),
+            args.phylip_out,
+            args.seqname_mapping,
+            args.inferred_naive_name,
+        )
+        args.phylip_out.close()
+        args.seqname_mapping.close()
+
+
+if __name__ == "__main__":
+    main()
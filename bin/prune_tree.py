@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Prune a newick tree down to the taxa listed in an id file (e.g. the FastTree tree down to `pruned_ids.txt`),
+preserving branch lengths, so that the result can be used as a starting/fixed topology for raxml-ng.
+"""
+
+import argparse
+
+import array_tree
+
+
+def ids_arg(filename):
+    with open(filename) as fh:
+        return [line.strip() for line in fh if line.strip()]
+
+
+def prune_tree(tree, keep_ids):
+    missing_ids = set(keep_ids) - set(tree.get_leaf_names())
+    if missing_ids:
+        raise Exception(
+            "ids to keep not found among tree leaves: {}".format(sorted(missing_ids))
+        )
+    tree.prune(keep_ids, preserve_branch_length=True)
+    # raxml-ng expects an unrooted (trifurcating root) tree; pruning can leave us with a bifurcating root.
+    if len(tree.children) == 2:
+        tree.unroot()
+    return tree
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "tree",
+        type=lambda x: array_tree.load(x).to_ete3(),
+        help="input newick tree file",
+    )
+    parser.add_argument("ids", type=ids_arg, help="file with one id to keep per line")
+    parser.add_argument("output", help="output newick tree file")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    tree = prune_tree(args.tree, args.ids)
+    # format 5: leaf names and all branch lengths, but no internal node names (FastTree support values)
+    tree.write(outfile=args.output, format=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+import argparse
+import re
+
+# Under GTR+G each DNA alignment pattern costs 4 rate categories x 4 states of likelihood work per node, so thread
+# synchronization only starts to dominate below about 100 patterns per thread. At one thread per 150 patterns, a typical
+# ~400bp BCR alignment (a few hundred patterns) gets 2-3 threads, and clusters only reach --max-threads with long or
+# very diverse alignments.
+PATTERNS_PER_THREAD = 150
+
+_PATTERNS = re.compile(r"Alignment comprises \d+ partitions? and (\d+) patterns")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="""Print a raxml-ng thread count (or the matching srun args) for an alignment, based on its
+        number of distinct alignment columns (patterns), as reported by `raxml-ng --parse`."""
+    )
+    parser.add_argument(
+        "parse_log", help="log of the `raxml-ng --parse` run for the alignment"
+    )
+    parser.add_argument("--max-threads", type=int, default=8)
+    parser.add_argument(
+        "--srun-args",
+        action="store_true",
+        help="print srun args requesting the corresponding cpus instead of raxml-ng args",
+    )
+    return parser.parse_args()
+
+
+def pattern_count(parse_log_fname):
+    with open(parse_log_fname) as fh:
+        for line in fh:
+            match = _PATTERNS.search(line)
+            if match:
+                return int(match.group(1))
+    raise ValueError(
+        "no alignment pattern count found in raxml-ng log {}".format(parse_log_fname)
+    )
+
+
+def thread_count(n_patterns, max_threads):
+    return max(1, min(max_threads, -(-n_patterns // PATTERNS_PER_THREAD)))
+
+
+def main():
+    args = get_args()
+    n_threads = thread_count(pattern_count(args.parse_log), args.max_threads)
+    if args.srun_args:
+        print "--cpus-per-task={} ".format(n_threads),
+    else:
+        print "--threads {} ".format(n_threads),
+
+
+if __name__ == "__main__":
+    main()
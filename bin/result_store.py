@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+A local, content-addressed store of build results, shared across clusters, partition steps and runs.
+
+Results are keyed on a hash of the contents of the inputs, the tool and its version, and any parameters, and are
+stored as one directory per key holding a copy of each output file. A result is retrieved by hard-linking those files
+to the requested output paths (falling back to copying across filesystems). Whenever a result is used its directory's
+mtime is updated. The store keeps a running total of its size, and once adding a result takes it over the size limit,
+least recently used results are evicted to bring it back under.
+
+Build steps use this as
+
+    result_store.py fetch ... || (command && result_store.py put ...)
+
+with the same --store, key and --targets options given to both (see sconsutils.SRun).
+"""
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+DEFAULT_MAX_SIZE_GB = 20.0
+
+
+def file_digest(fname, blocksize=1 << 20):
+    digest = hashlib.sha1()
+    with open(fname, "rb") as fh:
+        for block in iter(lambda: fh.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def result_key(sources, tool=None, version=None, params=None):
+    "Hash of the contents of the source files (in order), and the tool, version and parameters that produce the result"
+    digest = hashlib.sha1()
+    for field in (tool, version, params):
+        digest.update("{}\n".format(field).encode("utf-8"))
+    for source in sources:
+        digest.update("{}\n".format(file_digest(source)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def entry_dir(store, key):
+    return os.path.join(store, key[:2], key)
+
+
+def stored_name(i):
+    "Name of the i-th target within a store entry; targets are stored by position, since their paths differ by build"
+    return str(i)
+
+
+def link_or_copy(src, dest):
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+        # copies keep the read-only mode of the stored file, but these are our own
+        os.chmod(dest, 0o644)
+
+
+def fetch(store, key, targets):
+    """Link the stored result for key to targets, returning whether there was one. A result only counts if it has
+    exactly as many files as there are targets."""
+    entry = entry_dir(store, key)
+    stored = [os.path.join(entry, stored_name(i)) for i in range(len(targets))]
+    if not all(os.path.isfile(f) for f in stored):
+        return False
+    for src, target in zip(stored, targets):
+        if os.path.dirname(target) and not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        link_or_copy(src, target)
+    # mark as recently used
+    os.utime(entry, None)
+    return True
+
+
+def size_fname(store):
+    return os.path.join(store, ".size")
+
+
+def update_size(store, added=None, total=None):
+    """Add `added` bytes to the store's running size total (or set it to `total`), returning the new total. The total
+    is None if it isn't known (e.g. in a store which has never been evicted), in which case adding doesn't change
+    it."""
+    with open(size_fname(store), "a+") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        fh.seek(0)
+        current = fh.read().strip()
+        if total is None:
+            if not current:
+                return None
+            total = int(current) + (added or 0)
+        fh.seek(0)
+        fh.truncate()
+        fh.write("{}\n".format(total))
+        return total
+
+
+def put(store, key, targets, max_size=None):
+    """Store targets as the result for key (unless already stored), then evict down to max_size bytes if that took the
+    store over it"""
+    entry = entry_dir(store, key)
+    added = 0
+    if os.path.isdir(entry):
+        os.utime(entry, None)
+    else:
+        parent = os.path.dirname(entry)
+        try:
+            os.makedirs(parent)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # build the entry under a temporary name and rename it into place, so that concurrent builds never see a
+        # partial result
+        tmp_entry = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+        try:
+            for i, target in enumerate(targets):
+                stored = os.path.join(tmp_entry, stored_name(i))
+                shutil.copy2(target, stored)
+                # stored files are shared by hard links with build outputs, so must never be modified in place
+                os.chmod(stored, 0o444)
+            try:
+                os.rename(tmp_entry, entry)
+                added = sum(os.path.getsize(t) for t in targets)
+            except OSError:
+                # someone else stored this result first
+                if not os.path.isdir(entry):
+                    raise
+        finally:
+            if os.path.isdir(tmp_entry):
+                shutil.rmtree(tmp_entry)
+    if max_size is not None:
+        total = update_size(store, added=added)
+        if total is None or total > max_size:
+            evict(store, max_size)
+
+
+def entries(store):
+    "(mtime, size, path) of each result in the store"
+    for prefix in os.listdir(store):
+        prefix_dir = os.path.join(store, prefix)
+        if not os.path.isdir(prefix_dir):
+            continue
+        for key in os.listdir(prefix_dir):
+            entry = os.path.join(prefix_dir, key)
+            if key.startswith(".tmp-") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)
+                )
+                yield os.path.getmtime(entry), size, entry
+            except OSError:
+                # evicted by a concurrent build
+                continue
+
+
+def evict(store, max_size):
+    """Remove least recently used results until the store is no larger than max_size bytes, and reset the running size
+    total from what's left. This scans the whole store; put only calls it when over."""
+    store_entries = sorted(entries(store))
+    total = sum(size for _, size, _ in store_entries)
+    for _, size, entry in store_entries:
+        if total <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+    update_size(store, total=total)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("command", choices=["fetch", "put", "key", "evict"])
+    parser.add_argument("--store", required=True, help="store directory")
+    parser.add_argument(
+        "--sources", nargs="*", default=[], help="files whose contents key the result"
+    )
+    parser.add_argument("--targets", nargs="*", default=[])
+    parser.add_argument("--tool", help="name of the program producing the result")
+    parser.add_argument("--tool-version")
+    parser.add_argument(
+        "--params", help="parameters (other than file paths) affecting the result"
+    )
+    parser.add_argument(
+        "--max-size",
+        type=float,
+        default=DEFAULT_MAX_SIZE_GB,
+        help="size (in GB) to evict the store down to after adding results",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    max_size = int(args.max_size * 1e9)
+    if args.command == "evict":
+        evict(args.store, max_size)
+        return
+    key = result_key(args.sources, args.tool, args.tool_version, args.params)
+    if args.command == "key":
+        print(key)
+    elif args.command == "fetch":
+        if not fetch(args.store, key, args.targets):
+            sys.exit(1)
+        sys.stderr.write("using stored result {}\n".format(entry_dir(args.store, key)))
+    elif args.command == "put":
+        put(args.store, key, args.targets, max_size)
+
+
+if __name__ == "__main__":
+    main()
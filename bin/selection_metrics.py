@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compute selection metrics for every node of a reconstructed tree, without running partis:
+
+* lbi: local branching index (Neher et al. 2014), the tau-discounted tree length surrounding each node
+* lbr: local branching ratio, the part of lbi coming from a node's descendants over the part coming from its parent
+* cons-dist-aa: (minus) the amino acid hamming distance of each sequence to the consensus of all the sequences
+
+lbi and lbr are computed with one postorder pass (messages from each node's subtree up to its parent) and one preorder
+pass (messages from the rest of the tree down to each node), so are linear in the size of the tree. Output is written
+in the same YAML structure as `partis --selection-metric-fname`, as read by merge_selection_metrics.py.
+"""
+
+from __future__ import division
+
+import argparse
+import collections
+import math
+
+import ete3
+import yaml
+from Bio import SeqIO
+
+# partis' default lb tau, appropriate for typical BCR mutation rates
+default_tau = 0.0025
+ambiguous_aas = set("X-*")
+
+
+def branch_message(length, tau):
+    "Contribution of a branch of the given length to the lbi of the nodes at either end"
+    return tau * (1 - math.exp(-length / tau))
+
+
+def lb_values(tree, tau=default_tau):
+    """Returns dicts of lbi and lbr by node name, for all named nodes of the ete3 tree."""
+    nodes = list(tree.traverse("preorder"))
+    # messages passed up to each node's parent, summarizing its subtree
+    up = {}
+    for node in reversed(nodes):
+        decay = math.exp(-node.dist / tau)
+        up[node] = branch_message(node.dist, tau) + decay * sum(
+            up[child] for child in node.children
+        )
+    # messages passed down to each node from its parent, summarizing the rest of the tree
+    down = {tree: 0.0}
+    for node in nodes:
+        from_children = sum(up[child] for child in node.children)
+        for child in node.children:
+            decay = math.exp(-child.dist / tau)
+            down[child] = branch_message(child.dist, tau) + decay * (
+                down[node] + from_children - up[child]
+            )
+    lbi, lbr = {}, {}
+    for node in nodes:
+        if not node.name:
+            continue
+        from_children = sum(up[child] for child in node.children)
+        lbi[node.name] = down[node] + from_children
+        lbr[node.name] = from_children / down[node] if down[node] > 0 else 0.0
+    return lbi, lbr
+
+
+def consensus(seqs):
+    "Most common unambiguous amino acid at each position (ties broken alphabetically), or X if there is none"
+    cons = []
+    for column in zip(*seqs):
+        counts = collections.Counter(aa for aa in column if aa not in ambiguous_aas)
+        cons.append(min(counts, key=lambda aa: (-counts[aa], aa)) if counts else "X")
+    return "".join(cons)
+
+
+def hamming_distance(seq1, seq2):
+    return sum(
+        a != b and a not in ambiguous_aas and b not in ambiguous_aas
+        for a, b in zip(seq1, seq2)
+    )
+
+
+def cons_dist_aa(aa_seqs):
+    """Returns a dict of minus the hamming distance between each of the (id, sequence) pairs aa_seqs and their
+    consensus, by sequence id (as in partis, so that larger values are closer to consensus).
+    """
+    cons = consensus([seq for _, seq in aa_seqs])
+    return {seqid: -hamming_distance(cons, seq) for seqid, seq in aa_seqs}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("tree", help="newick tree with named internal nodes")
+    parser.add_argument(
+        "aa_seqs", help="amino acid sequences (aligned) for the nodes of the tree"
+    )
+    parser.add_argument("outfile", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--tau",
+        type=float,
+        default=default_tau,
+        help="length scale (in substitutions per site) over which lbi and lbr are discounted",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    tree = ete3.Tree(args.tree, format=1)
+    lbi, lbr = lb_values(tree, args.tau)
+    cons_dist = cons_dist_aa(
+        [(sr.id, str(sr.seq)) for sr in SeqIO.parse(args.aa_seqs, "fasta")]
+    )
+    yaml.safe_dump(
+        [{"lb": {"lbi": lbi, "lbr": lbr, "cons-dist-aa": cons_dist}}],
+        args.outfile,
+        default_flow_style=False,
+    )
+    args.outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 #!/usr/bin/env python
 
 import argparse
-from Bio import SeqIO, SeqRecord, Seq, Alphabet
+from Bio import SeqIO, SeqRecord
+from Bio.Seq import Seq
 import json
 
+import alignment_io
+import translation
+
 
 def translate(s):
     """
     Assume we are in frame and translate DNA to amino acids.
     """
-    coding_dna = Seq.Seq(s[: (3 * int(len(s) / 3))], Alphabet.IUPAC.ambiguous_dna)
-    return str(coding_dna.translate())
+    return translation.translate(s)
 
 
 def get_frame(metadata_handle):
@@ -23,20 +26,20 @@ def trim_end(seqrecord, frame):
     return ((len(seqrecord.seq) - frame) / 3) * 3 + frame
 
 
-def translate_seqrecord(seqrecord, frame):
-    end = trim_end(seqrecord, frame)
-    trans_seq = Seq.Seq(str(seqrecord.seq[frame:end]).replace("-", "")).translate()
-    trans_seqrecord = SeqRecord.SeqRecord(
-        trans_seq,
-        id=seqrecord.id,
-        name=seqrecord.name,
-        description=seqrecord.description,
-    )
-    return trans_seqrecord
-
-
 def translate_seqrecords(seqrecords, frame):
-    return (translate_seqrecord(sr, frame) for sr in seqrecords)
+    """
+    Translate (with gaps removed) the in-frame portion of all seqrecords in one batch.
+    """
+    seqrecords = list(seqrecords)
+    translated = translation.translate_batch(
+        (sr.seq[frame : trim_end(sr, frame)] for sr in seqrecords)
+    )
+    return (
+        SeqRecord.SeqRecord(
+            Seq(trans_seq), id=sr.id, name=sr.name, description=sr.description
+        )
+        for sr, trans_seq in zip(seqrecords, translated)
+    )
 
 
 def trim_seqrecord(seqrecord, frame):
@@ -58,7 +61,11 @@ def trim_seqrecords(seqrecords, frame):
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("metadata", type=argparse.FileType("r"))
-    parser.add_argument("inseqs", type=lambda x: list(SeqIO.parse(x, "fasta")))
+    parser.add_argument(
+        "inseqs",
+        type=lambda x: list(alignment_io.read_alignment(x).seqrecords()),
+        help="FASTA or alignment container",
+    )
     parser.add_argument("outseqs", type=argparse.FileType("w"))
     parser.add_argument(
         "-t",
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Batch codon translation of nucleotide sequences.
+
+Sequences are encoded as arrays of nucleotide codes (A=0, C=1, G=2, T=3), and all codons of all sequences are
+translated at once through a 64-entry lookup table. Codons containing anything other than ACGT (ambiguity codes,
+or partial gaps) are rare, and are translated individually with Biopython.
+"""
+
+import argparse
+import sys
+
+import numpy
+from Bio import SeqIO
+from Bio.Data import CodonTable
+from Bio.Data.CodonTable import TranslationError
+from Bio.Seq import Seq
+
+NUCLEOTIDES = "ACGT"
+
+# Maps each byte to its nucleotide code, with everything else (ambiguity codes, gaps, ...) mapped to 4
+_NUCLEOTIDE_CODES = numpy.full(256, 4, dtype=numpy.uint8)
+for _code, _nt in enumerate(NUCLEOTIDES):
+    _NUCLEOTIDE_CODES[ord(_nt)] = _NUCLEOTIDE_CODES[ord(_nt.lower())] = _code
+_NUCLEOTIDE_CODES[ord("U")] = _NUCLEOTIDE_CODES[ord("u")] = NUCLEOTIDES.index("T")
+_GAP_CODE = ord("-")
+
+
+def _codon_lookup(table=CodonTable.standard_dna_table):
+    "The amino acid (as a byte) for each codon, indexed by 16 * first + 4 * second + third nucleotide code"
+    lookup = numpy.zeros(64, dtype=numpy.uint8)
+    for i, first in enumerate(NUCLEOTIDES):
+        for j, second in enumerate(NUCLEOTIDES):
+            for k, third in enumerate(NUCLEOTIDES):
+                codon = first + second + third
+                aa = "*" if codon in table.stop_codons else table.forward_table[codon]
+                lookup[16 * i + 4 * j + k] = ord(aa)
+    return lookup
+
+
+CODON_LOOKUP = _codon_lookup()
+
+
+def translate_codon(codon, _cache={}):
+    "Translate a single codon with Biopython (handling ambiguity codes), translating untranslatable codons to X"
+    if codon not in _cache:
+        try:
+            _cache[codon] = str(Seq(codon).translate())
+        except TranslationError:
+            _cache[codon] = "X"
+    return _cache[codon]
+
+
+def coding_region(seq, frame=0, keep_gaps=False):
+    """The part of seq to translate: starting at frame, with gaps removed unless keep_gaps, and trimmed to a
+    whole number of codons."""
+    seq = str(seq)[frame:]
+    if not keep_gaps:
+        seq = seq.replace("-", "")
+    return seq[: len(seq) - len(seq) % 3]
+
+
+def translate_batch(seqs, frame=0, keep_gaps=False):
+    """Translate each of seqs (strings or Seqs) from the given frame offset, returning a list of protein sequence
+    strings. Gaps are removed before translation, unless keep_gaps, in which case gap codons translate to gaps and
+    partially gapped codons to X (as in `seqmagick convert --translate`)."""
+    regions = [coding_region(seq, frame, keep_gaps) for seq in seqs]
+    if not regions:
+        return []
+    raw = numpy.frombuffer("".join(regions).encode("ascii"), dtype=numpy.uint8)
+    codons = raw.reshape(-1, 3)
+    codes = _NUCLEOTIDE_CODES[codons]
+    # anything but ACGT gets 0 here, and is overwritten below
+    index = numpy.where(codes < 4, codes, 0).astype(numpy.intp)
+    translated = CODON_LOOKUP[16 * index[:, 0] + 4 * index[:, 1] + index[:, 2]]
+
+    nonstandard = numpy.flatnonzero((codes > 3).any(axis=1))
+    if len(nonstandard):
+        gap_counts = (codons[nonstandard] == _GAP_CODE).sum(axis=1)
+        for i, gap_count in zip(nonstandard, gap_counts):
+            if keep_gaps and gap_count == 3:
+                translated[i] = ord("-")
+            elif keep_gaps and gap_count:
+                translated[i] = ord("X")
+            else:
+                translated[i] = ord(
+                    translate_codon(codons[i].tobytes().decode("ascii"))
+                )
+
+    protein = translated.tobytes().decode("ascii")
+    ends = numpy.cumsum([len(region) // 3 for region in regions])
+    starts = numpy.concatenate([[0], ends[:-1]])
+    return [str(protein[start:end]) for start, end in zip(starts, ends)]
+
+
+def translate(seq, frame=0, keep_gaps=False):
+    return translate_batch([seq], frame, keep_gaps)[0]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "inseqs",
+        help="nucleotide sequences fasta, or - for stdin",
+    )
+    parser.add_argument("outseqs", type=argparse.FileType("w"))
+    parser.add_argument(
+        "--frame",
+        type=int,
+        default=0,
+        help="offset of the first codon in each sequence",
+    )
+    parser.add_argument(
+        "--keep-gaps",
+        action="store_true",
+        help="translate gap codons to gaps rather than removing gaps before translation",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    seqrecords = list(
+        SeqIO.parse(sys.stdin if args.inseqs == "-" else args.inseqs, "fasta")
+    )
+    for seqrecord, protein in zip(
+        seqrecords,
+        translate_batch(
+            (sr.seq for sr in seqrecords), frame=args.frame, keep_gaps=args.keep_gaps
+        ),
+    ):
+        args.outseqs.write(">{}\n{}\n".format(seqrecord.description, protein))
+    args.outseqs.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,41 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+Rewrite partis output file with subset of ids, adding the linearham info for the subset from the partis
+Smith-Waterman cache.
+
+The sw cache holds an annotation for every sequence in the sample, but only those of the subset are needed. With
+--sw-index, its annotations are written (once per sw cache, e.g. as a build target of its own, by running with
+--sw-cache and --sw-index alone) one pickled record each to an indexed file:
+
+    MAGIC
+    one pickled annotation per unique id (as in the cache, without partis' implicit info)
+    pickled index: {"stamp": (size, mtime) of the sw cache, "glfo": ..., "offsets": {unique id: (offset, length)}}
+    8 byte little-endian offset of the index
+
+Afterwards (as long as the sw cache's size and modification time haven't changed), only the index and the annotations
+of the subset are read, seeking to each, and only those get implicit info added. Without --sw-index, the whole sw cache
+is read. With --batch, subsets for any number of clusters (e.g. all the seeds of a sample) are written in one run,
+reading the sw cache index and each partition file once.
+"""
 
 import argparse
+import copy
 import os
 import os.path
 import csv
 import sys
 import json
+import struct
+import tempfile
 import textwrap
 import process_partis
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 # Figure out where partis is so that partis utils and glutils ccan be loaded below
 partis_path = os.environ.get("PARTIS")
 if not partis_path or not os.path.exists(partis_path):
@@ -25,53 +51,197 @@ if not partis_path or not os.path.exists(partis_path):
 sys.path.insert(1, os.path.join(partis_path, "python"))
 import utils
 
+SW_INDEX_MAGIC = b"CFTSWIX1"
+_OFFSET = struct.Struct("<Q")
+
+
+def file_stamp(fname):
+    """Size and modification time of fname, which identify the version of a sw cache that an index was written for,
+    without reading the (possibly many GB) cache itself"""
+    stat = os.stat(fname)
+    return (stat.st_size, stat.st_mtime)
 
-def read_sw_info(sw_cache, locus):
+
+def sw_uid(line):
+    assert (
+        len(line["unique_ids"]) == 1
+    )  # would only fail if this was not actually an sw cache file, checking to illustrate sw case is special
+    return line["unique_ids"][0]
+
+
+def read_sw_annotations(sw_cache, locus):
+    "glfo and annotations of the sw cache, without implicit info"
     sw_cache_glfo = (
         utils.replace_suffix(sw_cache, "-glfo")
         if utils.getsuffix(sw_cache) == ".csv"
         else None
     )
-    _, sw_annotations, _ = process_partis.read_partis_output(
-        sw_cache, sw_cache_glfo, locus
+    glfo, sw_annotations, _ = process_partis.read_partis_output(
+        sw_cache, sw_cache_glfo, locus, add_implicit_info=False
     )
+    return glfo, sw_annotations
 
-    def sw_uid(line):
-        assert (
-            len(line["unique_ids"]) == 1
-        )  # would only fail if this was not actually an sw cache file, checking to illustrate sw case is special
-        return line["unique_ids"][0]
 
-    return {sw_uid(adict): adict for adict in sw_annotations}
+def write_sw_index(index_fname, glfo, sw_annotations, stamp):
+    """Write the index file for a sw cache (under a temporary name, renamed into place, so that it's never seen
+    partially written)"""
+    fd, tmp_fname = tempfile.mkstemp(
+        dir=os.path.dirname(index_fname) or ".", prefix=".tmp-"
+    )
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(SW_INDEX_MAGIC)
+            offsets = {}
+            for line in sw_annotations:
+                record = pickle.dumps(line, pickle.HIGHEST_PROTOCOL)
+                offsets[sw_uid(line)] = (fh.tell(), len(record))
+                fh.write(record)
+            index_offset = fh.tell()
+            pickle.dump(
+                {"stamp": stamp, "glfo": glfo, "offsets": offsets},
+                fh,
+                pickle.HIGHEST_PROTOCOL,
+            )
+            fh.write(_OFFSET.pack(index_offset))
+        os.rename(tmp_fname, index_fname)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname)
+
 
+def read_sw_index(index_fname, stamp):
+    "The index of the index file, or None if it doesn't exist or is for a different sw cache"
+    try:
+        with open(index_fname, "rb") as fh:
+            if fh.read(len(SW_INDEX_MAGIC)) != SW_INDEX_MAGIC:
+                return None
+            fh.seek(-_OFFSET.size, os.SEEK_END)
+            (index_offset,) = _OFFSET.unpack(fh.read(_OFFSET.size))
+            fh.seek(index_offset)
+            index = pickle.load(fh)
+    except (
+        IOError,
+        OSError,
+        EOFError,
+        ValueError,
+        struct.error,
+        pickle.UnpicklingError,
+    ):
+        return None
+    return index if index.get("stamp") == stamp else None
 
-def iseqs_from_uids(uids_file, cluster_annotation):
-    with open(args.subset_ids_path) as f:
-        ids = f.readlines()
-    ids = [id.rstrip("\n") for id in ids]
+
+class SWCache(object):
+    """Access to the annotations of a partis sw cache, by unique id. Given an index_fname, they are read through that
+    index file, which is (re)written first if it is missing or out of date."""
+
+    def __init__(self, sw_cache, locus=None, index_fname=None):
+        self.index_fname = index_fname
+        # only used without an index file
+        self.lines = None
+        stamp = file_stamp(sw_cache)
+        index = read_sw_index(index_fname, stamp) if index_fname else None
+        if index is None:
+            glfo, sw_annotations = read_sw_annotations(sw_cache, locus)
+            if not index_fname:
+                self.glfo = glfo
+                self.lines = {sw_uid(line): line for line in sw_annotations}
+                return
+            write_sw_index(index_fname, glfo, sw_annotations, stamp)
+            index = read_sw_index(index_fname, stamp)
+        self.glfo = index["glfo"]
+        self.offsets = index["offsets"]
+
+    def read_lines(self, uids):
+        if self.lines is not None:
+            for uid in uids:
+                yield uid, self.lines[uid]
+            return
+        with open(self.index_fname, "rb") as fh:
+            # in file order, so the reads only ever seek forwards
+            for uid in sorted(uids, key=lambda uid: self.offsets[uid][0]):
+                offset, length = self.offsets[uid]
+                fh.seek(offset)
+                yield uid, pickle.loads(fh.read(length))
+
+    def sw_info(self, uids):
+        "{unique id: annotation} for the given unique ids, with implicit info"
+        sw_info = {}
+        for uid, line in self.read_lines(set(uids)):
+            utils.add_implicit_info(self.glfo, line)
+            sw_info[uid] = line
+        return sw_info
+
+
+def read_subset_ids(subset_ids_path):
+    with open(subset_ids_path) as f:
+        return set(line.rstrip("\n") for line in f)
+
+
+def iseqs_from_uids(ids, cluster_annotation):
     return [
         iseq for iseq, uid in enumerate(cluster_annotation["unique_ids"]) if uid in ids
     ]
 
 
+def write_subset(
+    sw_cache,
+    glfo,
+    annotation_list,
+    cpath,
+    partition_file,
+    subset_ids_path,
+    outfname,
+    partition_step,
+    original_cluster_size_idx=None,
+    original_cluster_unique_ids=None,
+):
+    # restrict_to_iseqs modifies the annotation, which is shared by every job for the same partition file
+    cluster_annotation = copy.deepcopy(
+        process_partis.choose_cluster(
+            partition_file,
+            annotation_list,
+            cpath,
+            partition_step,
+            original_cluster_size_idx,
+            original_cluster_unique_ids,
+        )
+    )
+    iseqs = iseqs_from_uids(read_subset_ids(subset_ids_path), cluster_annotation)
+    sw_info = sw_cache.sw_info(cluster_annotation["unique_ids"][i] for i in iseqs)
+    utils.restrict_to_iseqs(cluster_annotation, iseqs, glfo, sw_info)
+    if cluster_annotation.get("linearham-info") is None:
+        utils.add_linearham_info(sw_info, [cluster_annotation])
+    utils.write_annotations(
+        outfname, glfo, [cluster_annotation], set(cluster_annotation)
+    )
+
+
+def batch_jobs(batch_fname):
+    """The subsets to write, from a JSON list of objects with the keys partition_file, subset_ids_path, outfname,
+    partition_step, and optionally original_cluster_size_idx or original_cluster_unique_ids (a list), as the
+    corresponding arguments"""
+    with open(batch_fname) as fh:
+        return json.load(fh)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Rewrite partis output file with subset of ids."
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
     )
     parser.add_argument(
-        "partition_file", type=str, help="Path to partis partition file"
+        "partition_file", type=str, nargs="?", help="Path to partis partition file"
     )
     parser.add_argument(
         "subset_ids_path",
         type=str,
+        nargs="?",
         help="Path to text file containing ids we want to use for the subset.",
     )
     parser.add_argument(
-        "outfname", type=str, help="The name of partis yaml file to write."
-    )
-    parser.add_argument(
-        "--partition-step", type=int, required=True, help="The partition step to use."
+        "outfname", type=str, nargs="?", help="The name of partis yaml file to write."
     )
+    parser.add_argument("--partition-step", type=int, help="The partition step to use.")
     parser.add_argument(
         "--original-cluster-size-idx",
         type=int,
@@ -88,6 +258,11 @@ if __name__ == "__main__":
         required=True,
         help="Partis smith-waterman cache file needed to rewrite linearham info.",
     )
+    parser.add_argument(
+        "--sw-index",
+        help="""Index file for --sw-cache (see above), written if missing or out of date. Given only --sw-cache and
+        --sw-index, just write the index.""",
+    )
     parser.add_argument(
         "--glfo-dir",
         help="path to germline info, only necessary for deprecated .csv output files",
@@ -95,25 +270,40 @@ if __name__ == "__main__":
     parser.add_argument(
         "--locus", help="Sample locus, only necessary for deprecated .csv output files"
     )
+    parser.add_argument(
+        "--batch",
+        help="JSON file listing subsets to write (see batch_jobs), e.g. for all seeds of a sample, instead of the positional arguments",
+    )
 
     args = parser.parse_args()
+    if args.batch:
+        jobs = batch_jobs(args.batch)
+    elif args.outfname and args.partition_step is not None:
+        jobs = [
+            {
+                "partition_file": args.partition_file,
+                "subset_ids_path": args.subset_ids_path,
+                "outfname": args.outfname,
+                "partition_step": args.partition_step,
+                "original_cluster_size_idx": args.original_cluster_size_idx,
+                "original_cluster_unique_ids": args.original_cluster_unique_ids,
+            }
+        ]
+    elif args.sw_index and args.partition_file is None and args.partition_step is None:
+        jobs = []
+    else:
+        parser.error(
+            "partition_file, subset_ids_path, outfname and --partition-step are required without --batch"
+        )
 
-    glfo, annotation_list, cpath = process_partis.read_partis_output(
-        args.partition_file, args.glfo_dir, args.locus
-    )
-    cluster_annotation = process_partis.choose_cluster(
-        args.partition_file,
-        annotation_list,
-        cpath,
-        args.partition_step,
-        args.original_cluster_size_idx,
-        args.original_cluster_unique_ids,
-    )
-    iseqs = iseqs_from_uids(args.subset_ids_path, cluster_annotation)
-    sw_info = read_sw_info(args.sw_cache, args.locus)
-    utils.restrict_to_iseqs(cluster_annotation, iseqs, glfo, sw_info)
-    if cluster_annotation.get("linearham-info") is None:
-        utils.add_linearham_info(sw_info, [cluster_annotation])
-    utils.write_annotations(
-        args.outfname, glfo, [cluster_annotation], set(cluster_annotation)
-    )
+    sw_cache = SWCache(args.sw_cache, args.locus, args.sw_index)
+    partition_file, partition = None, None
+    # one partition file in memory at a time
+    for job in sorted(jobs, key=lambda job: job["partition_file"]):
+        if job["partition_file"] != partition_file:
+            partition_file = job["partition_file"]
+            partition = process_partis.read_partis_output(
+                partition_file, args.glfo_dir, args.locus
+            )
+        glfo, annotation_list, cpath = partition
+        write_subset(sw_cache, glfo, annotation_list, cpath, **job)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Partis cluster annotations, loaded on demand rather than held in the nest control dicts.
+
+Nest levels only carry a reference to a cluster (its partition file and unique ids), and build targets that need the
+annotation itself look it up here. Parsed partition files are kept in a small least recently used cache, so the scons
+process holds at most a few partition files' annotations at a time, however many clusters are being built. Summaries
+of each annotation (e.g. which sequences are functional) are computed on first use and cached along with it. Since
+nestly adds each target for every cluster in turn, and clusters from the same partition file are adjacent, each
+partition file is still parsed about once per target that needs it.
+"""
+
+import collections
+
+
+def cluster_key(unique_ids):
+    return tuple(unique_ids)
+
+
+class AnnotationCache(object):
+    def __init__(self, read_fn, summary_fn=None, max_files=2):
+        """read_fn(partition_file, glfo_dir, locus) returns (glfo, annotation_list, cpath), as
+        process_partis.read_partis_output, and summary_fn(annotation) a summary of an annotation, as
+        process_partis.annotation_summary"""
+        self.read_fn = read_fn
+        self.summary_fn = summary_fn
+        self.max_files = max_files
+        # (partition file, glfo dir, locus) -> (annotation_list, cpath, {cluster key: annotation}, {cluster key:
+        # summary}), least recent first
+        self._entries = collections.OrderedDict()
+
+    def _entry(self, partition_file, glfo_dir=None, locus=None):
+        key = (partition_file, glfo_dir, locus)
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            _, annotation_list, cpath = self.read_fn(partition_file, glfo_dir, locus)
+            index = {}
+            for line in annotation_list or []:
+                # the first annotation for a cluster wins, as in process_partis.choose_cluster
+                index.setdefault(cluster_key(line["unique_ids"]), line)
+            entry = (annotation_list, cpath, index, {})
+            while len(self._entries) >= self.max_files:
+                self._entries.popitem(last=False)
+        self._entries[key] = entry
+        return entry
+
+    def read(self, partition_file, glfo_dir=None, locus=None):
+        "(annotation_list, cpath) for the partition file"
+        annotation_list, cpath, _, _ = self._entry(partition_file, glfo_dir, locus)
+        return annotation_list, cpath
+
+    def annotation(self, partition_file, unique_ids, glfo_dir=None, locus=None):
+        "The annotation of the cluster with the given unique ids in the partition file, or None if it has none"
+        _, _, index, _ = self._entry(partition_file, glfo_dir, locus)
+        return index.get(cluster_key(unique_ids))
+
+    def summary(self, partition_file, unique_ids, glfo_dir=None, locus=None):
+        "summary_fn of the annotation of the cluster (see annotation), or None if it has no annotation"
+        _, _, index, summaries = self._entry(partition_file, glfo_dir, locus)
+        key = cluster_key(unique_ids)
+        if key not in summaries:
+            annotation = index.get(key)
+            summaries[key] = None if annotation is None else self.summary_fn(annotation)
+        return summaries[key]
+
+    def clear(self):
+        self._entries.clear()
@@ -12,67 +12,76 @@ partis_path = os.environ.get("PARTIS", default_partis_path)
 sys.path.append(os.path.join(partis_path, "python"))
 import utils as partisutils
 
-# What follows is a rather convoluted backtranslation strategy for sequence alignment.
+# Backtranslation strategy for sequence alignment.
 # The basic idea is that we translate our sequences, align them (taking advantage of coding information),
-# and from this infer the a nucleotide alignment using `seqmagick backtrans-align`.
-# The problem is that `seqmagick` rather finicky here about sequence ordering and nucleotide seqs being in
-# lengths of multiples of three.
-# So there's a bunch of housekeeping here in making sure all of this is the case for our final backtrans-align
-# step.
+# and from this infer a nucleotide alignment by threading each sequence's codons back through its aligned
+# translation. All of this happens in one process in `bin/codon_align.py`; only muscle itself runs externally,
+# and its alignments are cached by content (in --alignment-cache-dir, a result store; see bin/result_store.py) so
+# identical clusters don't get re-aligned.
+
+
+# Number of processes used to align sequences against the inferred naive with --alignment-method anchored
+anchored_alignment_processes = 4
 
 
 def add(env, w, options):
     if options["preserve_indels"]:
 
         @w.add_target()
-        def translated_inseqs_(outdir, c):
-            return env.Command(
+        def _codon_alignment(outdir, c):
+            codon_alignment = env.SRun(
                 [
-                    os.path.join(outdir, "translated_inseqs.fa"),
-                    os.path.join(outdir, "inseqs_trimmed.fa"),
+                    os.path.join(outdir, fname)
+                    for fname in [
+                        "translated_inseqs.fa",
+                        "inseqs_trimmed.fa",
+                        "aligned_translated_inseqs.fa",
+                        "aligned_inseqs.fa",
+                    ]
                 ],
-                [c["partis_metadata"], c["inseqs"]],
-                "translate_seqs.py $SOURCES $TARGET -t ${TARGETS[1]}",
+                [c["cluster_signature"], c["inseqs_alignment"]],
+                "codon_align.py $SOURCES"
+                + " --translated-out ${TARGETS[0]}"
+                + " --trimmed-out ${TARGETS[1]}"
+                + " --aligned-translated-out ${TARGETS[2]}"
+                + " --aligned-out ${TARGETS[3]}"
+                + " --method "
+                + options["alignment_method"]
+                + (
+                    " --anchor-id {} --processes {}".format(
+                        options["inferred_naive_name"], anchored_alignment_processes
+                    )
+                    if options["alignment_method"] == "anchored"
+                    else ""
+                )
+                + (
+                    " --cache-dir {} --cache-max-size {}".format(
+                        options["alignment_cache_dir"], options["result_store_max_size"]
+                    )
+                    if options["alignment_cache_dir"]
+                    else ""
+                )
+                + " 2> ${TARGETS[3]}-.log",
+                srun_args="`alignment_srun_args.py ${{SOURCES[1]}} --method {} --processes {}`".format(
+                    options["alignment_method"], anchored_alignment_processes
+                ),
             )
+            env.Depends(codon_alignment, "bin/codon_align.py")
+            return codon_alignment
 
         @w.add_target()
         def translated_inseqs(outdir, c):
-            return c["translated_inseqs_"][0]
+            return c["_codon_alignment"][0]
 
         @w.add_target()
         def trimmed_inseqs(outdir, c):
-            return c["translated_inseqs_"][1]
+            return c["_codon_alignment"][1]
 
         @w.add_target()
         def aligned_translated_inseqs(outdir, c):
-            return env.SRun(
-                os.path.join(outdir, "aligned_translated_inseqs.fa"),
-                c["translated_inseqs"],
-                # Replace stop codons with X, or muscle inserts gaps, which messed up seqmagick backtrans-align below
-                # Note that things will break down at backtrans-align if any seq ids have * in them...
-                "sed 's/\*/X/g' $SOURCE | muscle -in /dev/stdin -out $TARGET 2> $TARGET-.log",
-                srun_args="`alignment_srun_args.py $SOURCE`",
-            )
+            return c["_codon_alignment"][2]
 
-        # Sort the sequences to have the same order, so that seqmagick doesn't freak out
-
-        @w.add_target()
-        def sorted_inseqs(outdir, c):
-            return env.Command(
-                os.path.join(outdir, "sorted_inseqs.fa"),
-                c["trimmed_inseqs"],
-                "seqmagick convert --sort name-asc $SOURCE $TARGET",
-            )
-
-        @w.add_target()
-        def sorted_aligned_translated_inseqs(outdir, c):
-            return env.Command(
-                os.path.join(outdir, "sorted_aligned_translated_inseqs.fa"),
-                c["aligned_translated_inseqs"],
-                "seqmagick convert --sort name-asc $SOURCE $TARGET",
-            )
-
-    # Now, finally, we can backtranslate
+    # The nucleotide alignment used for everything downstream
 
     @w.add_target()
     def aligned_inseqs(outdir, c):
@@ -86,10 +95,6 @@ def add(env, w, options):
                     before relying on this alignment for inference and moving forward with analysis of these clonal families.
                 """
             warnings.warn(partisutils.color("red", msg))
-            return env.Command(
-                aligned_inseqs_fname,
-                [c["sorted_aligned_translated_inseqs"], c["sorted_inseqs"]],
-                "seqmagick backtrans-align -a warn $SOURCES -o $TARGET",
-            )
+            return c["_codon_alignment"][3]
         else:
             return env.Command(aligned_inseqs_fname, c["inseqs"], "cp $SOURCE $TARGET")
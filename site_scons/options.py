@@ -60,6 +60,18 @@ Script.AddOption(
     help="""Use dnaml for maximum likelihood tree building and ancestral state reconstruction instead of default: raxml-ng.""",
 )
 
+Script.AddOption(
+    "--raxml-ng-mode",
+    dest="raxml_ng_mode",
+    type="choice",
+    choices=["search", "fasttree-search", "fasttree-asr"],
+    default="search",
+    help="""How raxml-ng gets its tree topology. 'search' (default) runs a full raxml-ng tree search before ASR.
+        'fasttree-search' seeds that search with the FastTree topology pruned to the pruned ids. 'fasttree-asr' skips the
+        tree search entirely, and runs ASR (optimizing model parameters and branch lengths) directly on the pruned
+        FastTree topology in a single raxml-ng invocation.""",
+)
+
 Script.AddOption(
     "--prune-strategies",
     dest="prune_strategies",
@@ -97,10 +109,19 @@ Script.AddOption(
     dest="lazy_metadata",
     action="store_true",
     default=False,
-    help="""Turns off the default `AlwaysBuild` setting on the various json metadata targets. Without `AlwaysBuild`, metadata
-        files may not update properly if any of the SConstruct code changed. However, this can be useful for improving build
-        time when debugging, or when only code in scripts has changed. If `--lazy-metadata` is used, it's best to run again
-        before using any of the output metadata.json files.""",
+    help="""By default, each json metadata target depends on a signature of its nest level's control dict and of the
+        SConstruct code, so that it is rebuilt exactly when its contents would change. `--lazy-metadata` turns this off,
+        so metadata files may not update properly if any of the SConstruct code changed. This saves computing the
+        signatures when debugging, but if it is used, it's best to run again before using any of the output metadata.json
+        files.""",
+)
+
+Script.AddOption(
+    "--always-build-metadata",
+    dest="always_build_metadata",
+    action="store_true",
+    default=False,
+    help="""Rebuild all json metadata targets on every run (`AlwaysBuild`), rather than when their signatures change.""",
 )
 
 Script.AddOption(
@@ -110,6 +131,25 @@ Script.AddOption(
     help="""What do we call the partis-inferred naive sequence when we inject it among the other (input) sequences.""",
 )
 
+Script.AddOption(
+    "--partis-selection-metrics",
+    dest="partis_selection_metrics",
+    action="store_true",
+    default=False,
+    help="""Compute selection metrics (lbi, lbr, cons-dist-aa) by running `partis annotate --get-selection-metrics` on the
+        ASR sequences, rather than directly from the ASR tree and translated sequences (the default).""",
+)
+
+Script.AddOption(
+    "--collapse-duplicates",
+    dest="collapse_duplicates",
+    action="store_true",
+    default=False,
+    help="""Collapse identical aligned sequences of each cluster into one representative before building trees. The
+        representative carries the summed multiplicities (in total and by timepoint) of the sequences collapsed into it,
+        and their ids as duplicates in tip_seqmeta.csv.""",
+)
+
 Script.AddOption(
     "--fasttree-png",
     dest="fasttree_png",
@@ -135,6 +175,48 @@ Script.AddOption(
     help="""Setting this flag assumes there are indels and does not use indel reversed input sequences (indel reversed sequences are used by default). Instead, partis 'input_seqs' key sequences are aligned and used as the cluster sequences.""",
 )
 
+Script.AddOption(
+    "--alignment-method",
+    dest="alignment_method",
+    type="choice",
+    choices=["muscle", "anchored"],
+    default="muscle",
+    help="""How translated sequences are aligned with --preserve-indels. 'muscle' (default) aligns all sequences
+        together. 'anchored' aligns each sequence against the inferred naive and merges these pairwise alignments,
+        falling back to muscle only for sequences which are too divergent from the naive; this scales near-linearly
+        with cluster size, and is recommended for large clusters.""",
+)
+
+Script.AddOption(
+    "--alignment-cache-dir",
+    dest="alignment_cache_dir",
+    metavar="DIR",
+    help="""Directory in which muscle alignments (of translated sequences, with --preserve-indels) are cached by
+        content, so that identical clusters are only aligned once. This is a result store (see bin/result_store.py), so
+        cached alignments are hard links into it, as for --result-store. Defaults to --result-store, so that alignments
+        share its size limit, and so is off unless either is given.""",
+)
+
+Script.AddOption(
+    "--result-store",
+    dest="result_store",
+    metavar="DIR",
+    help="""Directory of a content-addressed store of results (FastTree and raxml-ng trees, ASR, min-adcl pruning
+        and muscle alignments) keyed on their input contents, tool version and parameters, so that identical clusters
+        (across partition steps, seeds, other-partitions or reruns under a different --dataset-tag) are only computed
+        once. Off by default. Note that results built or fetched with the store are read-only hard links to the stored
+        copies, shared between every output directory (and build) using them, so must not be modified in place.""",
+)
+
+Script.AddOption(
+    "--result-store-max-size",
+    dest="result_store_max_size",
+    type="float",
+    default=20,
+    metavar="GB",
+    help="Least recently used results are evicted from --result-store to keep it under this size. Defaults to 20GB.",
+)
+
 
 def get_options(env):
     test_run, dataset_tag, match_indels_in_uid = (
@@ -150,6 +232,7 @@ def get_options(env):
         else ""
     )
     tag = "_".join(filter(None, [user_tag, test_tag, match_indels_in_uid_tag]))
+    result_store = env.GetOption("result_store") or None
     return dict(
         infiles=env.GetOption("infiles").split(":"),
         depth=int(env.GetOption("depth") or (3 if test_run else 30)),
@@ -164,12 +247,24 @@ def get_options(env):
         match_indels_in_uid=env.GetOption("match_indels_in_uid"),
         test_run=test_run,
         run_dnaml=env.GetOption("run_dnaml"),
+        raxml_ng_mode=env.GetOption("raxml_ng_mode"),
         prune_strategies=env.GetOption("prune_strategies").split(":"),
         dataset_tag=tag,
-        always_build_metadata=not env.GetOption("lazy_metadata"),
+        always_build_metadata=env.GetOption("always_build_metadata"),
+        metadata_signatures=not (
+            env.GetOption("lazy_metadata") or env.GetOption("always_build_metadata")
+        ),
         inferred_naive_name=env.GetOption("inferred_naive_name"),
         outdir_base=env.GetOption("outdir"),
+        alignment_method=env.GetOption("alignment_method"),
+        result_store=result_store,
+        result_store_max_size=env.GetOption("result_store_max_size"),
+        alignment_cache_dir=env.GetOption("alignment_cache_dir")
+        if env.GetOption("alignment_cache_dir") is not None
+        else result_store,
+        collapse_duplicates=env.GetOption("collapse_duplicates"),
         fasttree_png=env.GetOption("fasttree_png"),
+        partis_selection_metrics=env.GetOption("partis_selection_metrics"),
         preserve_indels=env.GetOption("preserve_indels")
         or (match_indels_in_uid is not None),
         write_linearham_yaml_input=env.GetOption("write_linearham_yaml_input"),
@@ -5,11 +5,17 @@ from SCons.Action import ActionFactory
 from SCons.Util import AddMethod
 from SCons.Script import Environment
 
+import SCons.Node
 import SCons.Util
 import os
 import time
 import subprocess
 import copy
+import glob
+import hashlib
+import json
+
+import software_versions
 
 # Utility functions
 # -----------------
@@ -41,6 +47,61 @@ def get_in(d, ks, default=None):
         return d.get(ks[0], default)
 
 
+# Metadata signatures
+# -------------------
+
+# The metadata.json written for each nest level is a function of that level's control dict and of the attribute mapping
+# set up in the SConstruct, neither of which SCons can see. Rather than `AlwaysBuild` these targets, we make each depend on
+# a Value node holding a hash of those inputs, so they are rebuilt exactly when they would change.
+
+
+def code_signature(paths):
+    "Hash of the contents of the given files (in order), e.g. the SConstruct and site_scons modules"
+    digest = hashlib.sha1()
+    for fname in paths:
+        with open(fname, "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def build_code_signature(root="."):
+    return code_signature(
+        [os.path.join(root, "SConstruct")]
+        + sorted(glob.glob(os.path.join(root, "site_scons", "*.py")))
+    )
+
+
+def _signature_default(obj):
+    # SCons nodes go into the metadata as their paths; anything else json can't serialize can't end up in the metadata
+    # either (e.g. the elided ClusterPath objects), so only its type matters, and not its (per-run) repr
+    if isinstance(obj, SCons.Node.Node):
+        return str(obj)
+    return type(obj).__name__
+
+
+def metadata_signature(parent_signature, value):
+    "Hash of a nest level's value, chained onto the signature of the enclosing level"
+    digest = hashlib.sha1(parent_signature.encode("utf-8"))
+    digest.update(
+        json.dumps(value, sort_keys=True, default=_signature_default).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+def sign_metadata(env, outdir, signature):
+    "Make the metadata.json in outdir depend on signature, returning the Value node holding it"
+    signature_node = env.Value(signature)
+    env.Depends(env.File(os.path.join(outdir, "metadata.json")), signature_node)
+    return signature_node
+
+
+def depend_on_ingested(env, outdir, target):
+    """Make the metadata.json in outdir depend on target, whose contents it ingests (`add_target(ingest=True)`),
+    returning target"""
+    env.Depends(env.File(os.path.join(outdir, "metadata.json")), target)
+    return target
+
+
 # Running commands on the cluster sometimes has the unfortunate side-effect of
 # letting distributed filesystems get out of sync.  A file that is written on
 # the cluster may not be visible on local machines for several seconds.  This
@@ -99,7 +160,58 @@ exit_code = subprocess.call(
 srun_exists = exit_code == 0
 
 
-def SRun(env, target, source, action, srun_args=None, **kwargs):
+def tool_version_key(tool):
+    """A single-word stand-in for the version of tool, for passing on the command line. Version strings can span
+    several lines (e.g. `raxml-ng --version`), which would break up the action."""
+    version = software_versions.version(tool)
+    return hashlib.sha1(str(version)).hexdigest()
+
+
+def store_args(env, store):
+    "Options for bin/result_store.py keying a result on $SOURCES and the `store` dict given to SRun"
+    return (
+        "--store {} --max-size {}".format(
+            env["RESULT_STORE"], env.get("RESULT_STORE_MAX_SIZE", 20)
+        )
+        + " --tool '{}' --tool-version {}".format(
+            store["tool"], tool_version_key(store["tool"])
+        )
+        + " --params '{}'".format(store.get("params", ""))
+        + " --sources $SOURCES "
+        + " ".join(store.get("scripts", []))
+        + " --targets $TARGETS"
+    )
+
+
+def stored_action(env, store, action):
+    """Wrap a command action (a string, or a list starting with one) so that its targets are fetched from the result
+    store when an identical result is there, and stored after running otherwise. `store` is a dict of the "tool"
+    producing the targets, "params" (a string of any options which affect the result, other than file paths) and
+    "scripts" (a list of script files whose code affects the result). Use this directly with env.Command, or pass
+    `store` to SRun. Does nothing unless env["RESULT_STORE"] is set."""
+    if not env.get("RESULT_STORE"):
+        return action
+    actions = list(action) if SCons.Util.is_List(action) else [action]
+    command = actions[0]
+    # keep scons' ignore-errors prefix at the front
+    ignore_errors = command.startswith("- ")
+    # only run (or go to the cluster) for results which aren't already stored; storing is a no-op if the result was
+    # fetched
+    wrapped = "result_store.py fetch {} || ( {} )".format(
+        store_args(env, store), command[2:] if ignore_errors else command
+    )
+    actions[0] = "- " + wrapped if ignore_errors else wrapped
+    # a tolerated failure leaves no targets to store, so storing them must be tolerated too
+    actions.append(
+        ("- " if ignore_errors else "")
+        + "result_store.py put "
+        + store_args(env, store)
+    )
+    return actions
+
+
+def SRun(env, target, source, action, srun_args=None, store=None, **kwargs):
+    "Run action on the cluster with srun, if available; see stored_action for `store`"
     if not hasattr(target, "__iter__"):
         target = [target]
     waitfor = target
@@ -111,6 +223,8 @@ def SRun(env, target, source, action, srun_args=None, **kwargs):
             srun_base += srun_args + " "
         srun_base += "sh -c ' "
         action = [srun_base + action + " '", Wait(waitfor)]
+    if store is not None:
+        action = stored_action(env, store, action)
     result = env.Command(target=target, source=source, action=action, **kwargs)
     return result
 
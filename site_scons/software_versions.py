@@ -1,3 +1,4 @@
+import hashlib
 import subprocess
 
 # Recording software versions
@@ -26,6 +27,7 @@ software_versions = {
     "muscle": "muscle -version",
     "seqmagick": "seqmagick --version",
     "FastTree": None,
+    "raxml-ng": "raxml-ng --version",
     "tripl": tripl_version,
     "ete3": lambda: ete3.__version__,
     "biopython": lambda: Bio.__version__,
@@ -56,6 +58,31 @@ def software_info(prog):
     }
 
 
+_versions = {}
+
+
+def version(prog):
+    """A string identifying the installed version of prog, for keying stored results (see bin/result_store.py). For
+    programs without a version command, this is a hash of the executable."""
+    if prog not in _versions:
+        version_command = software_versions.get(prog)
+        try:
+            if callable(version_command):
+                _versions[prog] = str(version_command())
+            elif version_command:
+                _versions[prog] = subprocess.check_output(
+                    version_command.split(), stderr=subprocess.STDOUT
+                ).strip()
+            else:
+                executable = subprocess.check_output(["which", prog]).strip()
+                with open(executable, "rb") as fh:
+                    _versions[prog] = "sha1:" + hashlib.sha1(fh.read()).hexdigest()
+        except (OSError, subprocess.CalledProcessError):
+            # not installed here; it may still be available on cluster nodes
+            _versions[prog] = None
+    return _versions[prog]
+
+
 def add_software_versions(w):
     @w.add_target("cft.build:software")
     def software(outdir, c):